@@ -0,0 +1,72 @@
+# Benchmark of analysis_utils.anonymize_texts (one batched NLP pass per session) against anonymising each message separately,
+# on generated 100-message sessions. Also checks both produce identical redactions
+import random
+import timeit
+
+import utils.analysis_utils as analysis_utils
+
+NUMBER_OF_RUNS = 3
+SESSION_SIZES = [10, 100]
+MP_NAME = "Paul Holmes"
+MESSAGE_TEMPLATES = [
+    "What has {mp_name} done about the cost of living?",
+    "My name is {person} and I live in Hedge End, what is my MP doing about potholes?",
+    "Can you tell me how {mp_name} voted on the Rwanda bill in {year}?",
+    "I emailed {mp_name}'s office on {date} but never heard back, my number is 07700 900{digits}.",
+    "{person} told me the local hospital ward is closing, is that true?",
+    "Thank you, that was really helpful!",
+    "You can reach me at {email} if you need more details about my housing case.",
+]
+PEOPLE = ["John Doe", "Sarah Smith", "Priya Patel", "Tom Jones"]
+
+
+def generate_session(number_of_messages):
+    return [
+        random.choice(MESSAGE_TEMPLATES).format(
+            mp_name=MP_NAME,
+            person=random.choice(PEOPLE),
+            year=random.randint(2015, 2025),
+            date=f"{random.randint(1, 28)}/0{random.randint(1, 9)}/2024",
+            digits=random.randint(100, 999),
+            email=f"{random.choice(PEOPLE).split()[0].lower()}@example.com",
+        )
+        for _ in range(number_of_messages)
+    ]
+
+
+# Original implementation (one analyzer.analyze call per message), kept here only as the baseline for comparison
+def anonymize_text_original(text, mp_name):
+    results = analysis_utils.get_analyzer().analyze(text=text, entities=[], language="en")
+
+    omit_types = ["DATE_TIME", "NRP", "LOCATION", "URL"]
+
+    filtered_results = []
+    for result in results:
+        if result.entity_type in omit_types:
+            continue
+
+        matched_text = text[result.start:result.end]
+        if result.entity_type == "PERSON" and matched_text in [mp_name, f"{mp_name}'s", f"{mp_name}s", f"{mp_name} MP", f"MP {mp_name}"]:
+            continue
+
+        filtered_results.append(result)
+
+    anonymized = analysis_utils.get_anonymizer().anonymize(text=text, analyzer_results=filtered_results)
+    return anonymized.text
+
+
+random.seed(0)
+
+print(f"{'Messages':>8} {'Per message (ms)':>17} {'Batched (ms)':>13} {'Speedup':>8} {'Identical':>10}")
+
+for session_size in SESSION_SIZES:
+    session_messages = generate_session(session_size)
+
+    # Warm-up, and the outputs for the comparison
+    anonymised_original = [anonymize_text_original(message, MP_NAME) for message in session_messages]
+    anonymised_batched = analysis_utils.anonymize_texts(session_messages, MP_NAME)
+
+    time_original = timeit.timeit(lambda: [anonymize_text_original(message, MP_NAME) for message in session_messages], number=NUMBER_OF_RUNS) / NUMBER_OF_RUNS
+    time_batched = timeit.timeit(lambda: analysis_utils.anonymize_texts(session_messages, MP_NAME), number=NUMBER_OF_RUNS) / NUMBER_OF_RUNS
+
+    print(f"{session_size:>8} {time_original * 1000:>17.1f} {time_batched * 1000:>13.1f} {time_original / time_batched:>7.1f}x {str(anonymised_original == anonymised_batched):>10}")
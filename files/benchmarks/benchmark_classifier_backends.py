@@ -0,0 +1,77 @@
+# Benchmark of the zero-shot classifier backends (analysis_utils.CLASSIFIER_BACKENDS) - latency, memory, and score parity
+# with the full precision "torch" backend on a fixed message set. Memory is only measured if psutil is installed (it isn't
+# an app dependency), and "onnx-int8" requires onnx & onnxruntime
+import gc
+import timeit
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+import utils.analysis_utils as analysis_utils
+
+NUMBER_OF_RUNS = 3
+# Largest acceptable difference in any score from the full precision backend
+PARITY_TOLERANCE = 0.05
+MESSAGES = [
+    "What has my MP done about the cost of living?",
+    "I think the new housing development in my area is a terrible idea and should be stopped.",
+    "How did Paul Holmes vote on the Rwanda bill?",
+    "Thank you, that was really helpful!",
+    "Why won't the government nationalise the railways and raise taxes on the wealthy?",
+    "We need stricter border controls and lower immigration.",
+    "Can you tell me about the latest written questions asked by my MP?",
+    "I'm worried about the closure of our local hospital ward.",
+    "What is an early day motion?",
+    "The council keeps ignoring potholes on my road, it's ridiculous.",
+]
+
+
+def get_memory_mb():
+    return psutil.Process().memory_info().rss / 1024 ** 2 if psutil else None
+
+
+def classify(classifier):
+    return analysis_utils.batch_zero_shot_classify(MESSAGES, classifier, analysis_utils.CLASSIFICATION_LABELS)
+
+
+reference_scores = None
+
+print(f"{'Backend':<12} {'Load (s)':>9} {'Memory (MB)':>12} {'Classify (s)':>13} {'Max score diff':>15} {'Top label match':>16}")
+
+for backend in analysis_utils.CLASSIFIER_BACKENDS:
+    gc.collect()
+    memory_before = get_memory_mb()
+
+    try:
+        time_load = timeit.timeit(lambda: analysis_utils.load_classifier(backend), number=1)
+    except ImportError as e:
+        print(f"{backend:<12} Skipped - {e}")
+        continue
+
+    classifier = analysis_utils.load_classifier(backend)
+    memory_used = f"{get_memory_mb() - memory_before:.0f}" if psutil else "n/a"
+
+    # First run is a warm-up, and provides the scores for the parity check
+    scores = classify(classifier)
+    time_classify = timeit.timeit(lambda: classify(classifier), number=NUMBER_OF_RUNS) / NUMBER_OF_RUNS
+
+    # "torch" is first, so is the reference for the others
+    if reference_scores is None:
+        reference_scores = scores
+
+    score_pairs = [
+        (message_scores, reference_message_scores)
+        for label_set in scores
+        for message_scores, reference_message_scores in zip(scores[label_set], reference_scores[label_set])
+    ]
+    max_score_diff = max(abs(score - reference_score) for message_scores, reference_message_scores in score_pairs for score, reference_score in zip(message_scores, reference_message_scores))
+    top_label_matches = sum(message_scores.index(max(message_scores)) == reference_message_scores.index(max(reference_message_scores)) for message_scores, reference_message_scores in score_pairs)
+
+    parity = "" if max_score_diff <= PARITY_TOLERANCE else " (above tolerance)"
+    print(f"{backend:<12} {time_load:>9.2f} {memory_used:>12} {time_classify:>13.3f} {max_score_diff:>15.4f}{parity} {top_label_matches:>8}/{len(score_pairs)}")
+
+    # Only one model loaded at a time, so the memory of each is measured separately
+    del classifier
+    analysis_utils.load_classifier.clear()
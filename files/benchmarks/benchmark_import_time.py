@@ -0,0 +1,85 @@
+# Benchmark of the cold import time of each page of the app (and the utils modules they share), using python -X importtime.
+# Each target is imported in a fresh interpreter, so shared dependencies are counted for every page
+import argparse
+import ast
+import subprocess
+import sys
+from pathlib import Path
+
+# Run from the repo root, as with the app
+CWD = Path.cwd()
+NUMBER_OF_RUNS = 3
+# Slowest modules to list per target
+NUMBER_OF_SLOWEST_MODULES = 5
+PAGE_FILES = [CWD / "streamlit_app.py", *sorted((CWD / "pages").glob("*.py"))]
+MODULE_TARGETS = ["utils.streamlit_utils", "utils.rag_llm_utils", "utils.analysis_utils", "utils.location_utils"]
+
+
+def get_page_imports(page_file):
+    # Pages run Streamlit code when executed, so only their imports are timed
+    page_imports = []
+
+    for node in ast.parse(page_file.read_text(encoding="utf-8")).body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            page_imports.append(ast.unparse(node))
+
+    return "\n".join(page_imports)
+
+
+def time_imports(import_code):
+    # Returns (total seconds, {module: cumulative seconds})
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", import_code], cwd=CWD, capture_output=True, text=True)
+
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    # Lines are "import time: self [us] | cumulative | imported package", with nested imports indented
+    module_times = {}
+    total_time = 0
+
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative_us, module_name = line.removeprefix("import time:").split("|")
+        module_times[module_name.strip()] = int(cumulative_us) / 1_000_000
+
+        # Top-level imports (not indented) add up to the total
+        if not module_name[1:].startswith(" "):
+            total_time += int(cumulative_us) / 1_000_000
+
+    return total_time, module_times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the cold import time of each page of the app.")
+    parser.add_argument("--max-seconds", type=float, help="Exit with an error if any target's import time is above this (targets which fail to import always exit with an error).")
+    args = parser.parse_args()
+
+    targets = {page_file.relative_to(CWD).as_posix(): get_page_imports(page_file) for page_file in PAGE_FILES}
+    targets.update({module_name: f"import {module_name}" for module_name in MODULE_TARGETS})
+
+    slowest_target_time = 0
+    failed_targets = []
+    for target_name, import_code in targets.items():
+        try:
+            # Fastest run, to limit noise from the rest of the system
+            runs = [time_imports(import_code) for _ in range(NUMBER_OF_RUNS)]
+        except RuntimeError as e:
+            print(f"{target_name}: Failed to import - {e}")
+            failed_targets.append(target_name)
+            continue
+
+        total_time, module_times = min(runs, key=lambda run: run[0])
+        slowest_target_time = max(slowest_target_time, total_time)
+
+        print(f"{target_name}: {total_time:.2f}s")
+        for module_name, module_time in sorted(module_times.items(), key=lambda item: item[1], reverse=True)[:NUMBER_OF_SLOWEST_MODULES]:
+            print(f"    {module_name:<50} {module_time:>6.2f}s")
+
+    # A target which can't be imported has no time to check, so would otherwise pass
+    if failed_targets:
+        sys.exit(f"{len(failed_targets)}/{len(targets)} targets failed to import: {', '.join(failed_targets)}")
+
+    if args.max_seconds and slowest_target_time > args.max_seconds:
+        sys.exit(f"Slowest import time ({slowest_target_time:.2f}s) is above the {args.max_seconds:.2f}s target")
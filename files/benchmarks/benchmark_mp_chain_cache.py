@@ -0,0 +1,24 @@
+# Benchmark of the per-question setup cost in rag_llm_utils.ask_prompt - building the vector store, retriever and chain
+# for every question (as before) against reusing the cached per-MP chain from get_mp_chain
+import timeit
+
+import utils.rag_llm_utils as rag_llm_utils
+
+NUMBER_OF_QUESTIONS = 50
+MPS = ["Paul Holmes", "Jessica Toale", "Tom Hayes"]
+
+
+print(f"{'MP':<16} {'Uncached (ms)':>14} {'Cached (ms)':>12} {'Speedup':>8}")
+
+for mp_name in MPS:
+    rag_llm_utils.get_mp_chain.cache_clear()
+
+    # Uncached - the chain is rebuilt for every question
+    time_uncached = timeit.timeit(lambda: rag_llm_utils.get_mp_chain.__wrapped__(mp_name), number=NUMBER_OF_QUESTIONS) / NUMBER_OF_QUESTIONS
+
+    # Cached - built by the first question, then reused by every following one (first build included in the average)
+    time_cached = timeit.timeit(lambda: rag_llm_utils.get_mp_chain(mp_name), number=NUMBER_OF_QUESTIONS) / NUMBER_OF_QUESTIONS
+
+    print(f"{mp_name:<16} {time_uncached * 1000:>14.3f} {time_cached * 1000:>12.3f} {time_uncached / time_cached:>7.1f}x")
+
+print(f"\nCache: {rag_llm_utils.get_mp_chain.cache_info()}")
@@ -0,0 +1,50 @@
+# Micro-benchmark of ingestion_utils.split_text against the original (quadratic) chunker from the ingestion Lambdas
+import random
+import timeit
+
+import utils.ingestion_utils as ingestion_utils
+
+NUMBER_OF_RUNS = 3
+CHUNK_LENGTHS = [500, 1000, 4000]
+TEXT_SIZES_WORDS = [10000, 100000]
+
+
+# Original implementation, kept here only as the baseline for comparison
+def split_text_original(text, max_length=1000):
+    words = text.split()
+    chunks = []
+    current_chunk = []
+
+    for word in words:
+        if len(" ".join(current_chunk + [word])) > max_length:
+            chunks.append(" ".join(current_chunk))
+            current_chunk = [word]
+        else:
+            current_chunk.append(word)
+
+    if current_chunk:
+        chunks.append(" ".join(current_chunk))
+
+    return chunks
+
+
+def make_text(number_of_words):
+    # Roughly Hansard-like word lengths
+    random.seed(0)
+    vocabulary = ["the", "honourable", "member", "for", "constituency", "government", "minister", "question", "housing", "funding", "will", "of", "a", "to", "parliamentary"]
+
+    return " ".join(random.choice(vocabulary) for _ in range(number_of_words))
+
+
+print(f"{'Words':>8} {'Max length':>11} {'Original (s)':>13} {'New (s)':>9} {'Speedup':>8}")
+
+for number_of_words in TEXT_SIZES_WORDS:
+    text = make_text(number_of_words)
+
+    for max_length in CHUNK_LENGTHS:
+        assert split_text_original(text, max_length) == ingestion_utils.split_text(text, max_length), "Chunk outputs differ"
+
+        time_original = min(timeit.repeat(lambda: split_text_original(text, max_length), number=1, repeat=NUMBER_OF_RUNS))
+        time_new = min(timeit.repeat(lambda: ingestion_utils.split_text(text, max_length), number=1, repeat=NUMBER_OF_RUNS))
+
+        print(f"{number_of_words:>8} {max_length:>11} {time_original:>13.4f} {time_new:>9.4f} {time_original / time_new:>7.1f}x")
@@ -1,13 +1,13 @@
 
-import requests
 import time
 import json
 from openai import OpenAI
 from pinecone import Pinecone, ServerlessSpec
 from dotenv import load_dotenv
 import os
-import hashlib
+from datetime import datetime
 import utils.boto_utils as boto_utils
+import utils.ingestion_utils as ingestion_utils
 
 load_dotenv()
 
@@ -29,82 +29,20 @@ if index_name not in pc.list_indexes().names():
 
 dense_index = pc.Index(index_name)
 
-
-def get_embedding(text):
-    response = client_openai.embeddings.create(
-        model="text-embedding-3-small",
-        input=text,
-    )
-
-    return response.data[0].embedding, response.usage.total_tokens
-
-
-def split_text(text, max_length=1000):
-    words = text.split()
-    chunks = []
-    current_chunk = []
-
-    for word in words:
-        if len(" ".join(current_chunk + [word])) > max_length:
-            chunks.append(" ".join(current_chunk))
-            current_chunk = [word]
-        else:
-            current_chunk.append(word)
-
-    if current_chunk:
-        chunks.append(" ".join(current_chunk))
-
-
-    return chunks
-
-
-def split_long_strings(obj, max_length=1000):
-    if isinstance(obj, dict):
-        for key, value in obj.items():
-            if isinstance(value, str) and len(value) > max_length:
-                obj[key] = split_text(value, max_length)
-
-            else:
-                split_long_strings(value, max_length)
-
-    elif isinstance(obj, list):
-        for item in obj:
-            split_long_strings(item, max_length)
-
-    return obj
-
-
-def clean_value_types(data):
-    if isinstance(data, dict):
-        return {key: clean_value_types(value) for key, value in data.items()}
-    
-    elif isinstance(data, list):
-        return [clean_value_types(item) for item in data]
-    
-    elif isinstance(data, bool):
-        return "Yes" if data else "No"
-    
-    elif data is None:
-        return ""
-    
-    elif isinstance(data, int) or isinstance(data, float):
-        return str(data)
-    
-    else:
-        return data
+# Diff mode: only embed/upsert records whose content hash isn't already in the MP's namespace
+INGESTION_DIFF_MODE = os.getenv("INGESTION_DIFF_MODE", "True") == "True"
+embedding_cache = ingestion_utils.embedding_cache_init()
+ingestion_utils.http_cache_init()
 
 
 def batch_upsert_data(records, mp_name):
-    batches = []
-    batch_size = 100
-    
-    # Create batches of batch_size records
-    for i in range(0, len(records), batch_size):
-        batch = records[i:i + batch_size]
-        batches.append(batch)
+    # records can be any iterable (e.g. embed_records' generator), batches are sent concurrently as records arrive
+    # Raises ingestion_utils.IngestionError if any records still fail to upsert after retrying
+    with ingestion_utils.StreamingUpserter(dense_index, namespace=mp_name) as upserter:
+        for record in records:
+            upserter.add(record)
 
-    for current_batch in batches:
-        dense_index.upsert(current_batch, namespace=mp_name)
+    return upserter.stats
 
 
 def safe_get_nested(top_dict, nested_dict_key, default_value=None):
@@ -234,19 +172,18 @@ def store_early_day_motions_sponsored(_, data):
 
     mp_early_day_motions = {}
 
-    for edm_dict in data["items"]:
-        time.sleep(0.1)
-        edm_url = edm_dict["links"][0]["href"][:-5]
+    # Fetch every EDM detail page concurrently up front (retried on 429/5xx), results come back in the same order as data["items"]
+    edm_urls = [edm_dict["links"][0]["href"][:-5] for edm_dict in data["items"]]
+    edm_urls_data = ingestion_utils.fetch_all_json(edm_urls)
+
+    for edm_dict, edm_url, edm_url_data in zip(data["items"], edm_urls, edm_urls_data):
 
         mp_early_day_motions[edm_dict["value"]["title"]] = {
             "Date Motion Tabled": edm_dict["value"]["dateTabled"],
             "Number of Sponsors": edm_dict["value"]["sponsorsCount"],
         }
 
-        response = requests.get(edm_url)
-        if response.status_code == 200:
-            edm_url_data = response.json()
-
+        if edm_url_data:
             mp_early_day_motions[edm_dict["value"]["title"]]["Motion Text"] = edm_url_data["Response"]["MotionText"]
             mp_early_day_motions[edm_dict["value"]["title"]]["Primary Sponsor"] = edm_url_data["Response"]["PrimarySponsor"]["Name"]
             mp_early_day_motions[edm_dict["value"]["title"]]["Primary Sponsor Party"] = edm_url_data["Response"]["PrimarySponsor"]["Party"]
@@ -254,7 +191,7 @@ def store_early_day_motions_sponsored(_, data):
             mp_early_day_motions[edm_dict["value"]["title"]]["All Sponsors"] = {sponsor["Member"]["Name"] for sponsor in edm_url_data["Response"]["Sponsors"]}
 
         else:
-            print(f"{edm_url}\nError: {response.status_code}\n\n---------------")
+            print(f"{edm_url}\nError: No detail data collected\n\n---------------")
 
 
     return mp_early_day_motions
@@ -265,9 +202,11 @@ def store_contribution_summary(member_id, data):
 
     mp_contributions = {}
 
-    for contributions_dict in data["items"]:
-        time.sleep(0.1)
-        contribution_url = contributions_dict["links"][0]["href"]
+    # Fetch every debate page concurrently up front (retried on 429/5xx), results come back in the same order as data["items"]
+    contribution_urls = [contributions_dict["links"][0]["href"] for contributions_dict in data["items"]]
+    contribution_urls_data = ingestion_utils.fetch_all_json(contribution_urls)
+
+    for contributions_dict, contribution_url, contribution_url_data in zip(data["items"], contribution_urls, contribution_urls_data):
 
         mp_contributions[contributions_dict["value"]["debateTitle"]] = {
             "Total Contributions To Debate": contributions_dict["value"]["totalContributions"],
@@ -283,10 +222,7 @@ def store_contribution_summary(member_id, data):
             "Contributions": {},
         }
 
-        response = requests.get(contribution_url)
-        if response.status_code == 200:
-            contribution_url_data = response.json()
-
+        if contribution_url_data:
             for index, contribution in enumerate(contribution_url_data["Items"]):
                 contribution_counter = 1
 
@@ -311,7 +247,7 @@ def store_contribution_summary(member_id, data):
                     contribution_counter += 1
 
         else:
-            print(f"{contribution_url}\nError: {response.status_code}\n\n---------------")
+            print(f"{contribution_url}\nError: No detail data collected\n\n---------------")
 
     return mp_contributions
 
@@ -379,54 +315,15 @@ parliament_api = {
             "Biography": {"path": "{id}/Biography/", "function": store_biography_details, "pagination": False, "source": "https://members.parliament.uk/member/{id}/career"},
             "Registered Interests": {"path": "{id}/RegisteredInterests/", "function": store_registered_interests, "pagination": False, "source": "https://members.parliament.uk/member/{id}/registeredinterests"},
             "Latest Election Details": {"path": "{id}/LatestElectionResult/", "function": store_latest_election_details, "pagination": False, "source": "https://members.parliament.uk/member/{id}/electionresult"},
-            # "Supported Early Day Motions": {"path": "{id}/Edms?", "function": store_early_day_motions_sponsored, "pagination": True, "source": "https://members.parliament.uk/member/{id}/earlydaymotions", "latest_record_field": "id"},
-            # "Spoken Contributions": {"path": "{id}/ContributionSummary?", "function": store_contribution_summary, "pagination": True, "source": "https://members.parliament.uk/member/{id}/contributions", "latest_record_field": "debateId"},
-            # "Voting": {"path": "{id}/Voting?house=1&", "function": store_votes_data, "pagination": True, "source": "https://members.parliament.uk/member/{id}/voting", "latest_record_field": "id"},
-            # "Submitted Written Questions": {"path": "{id}/WrittenQuestions?", "function": store_written_questions_data, "pagination": True, "source": "https://members.parliament.uk/member/{id}/writtenquestions", "latest_record_field": "uin"},
+            # "Supported Early Day Motions": {"path": "{id}/Edms?", "function": store_early_day_motions_sponsored, "pagination": True, "source": "https://members.parliament.uk/member/{id}/earlydaymotions", "latest_record_field": "id", "latest_record_date_field": "dateTabled"},
+            # "Spoken Contributions": {"path": "{id}/ContributionSummary?", "function": store_contribution_summary, "pagination": True, "source": "https://members.parliament.uk/member/{id}/contributions", "latest_record_field": "debateId", "latest_record_date_field": "sittingDate"},
+            # "Voting": {"path": "{id}/Voting?house=1&", "function": store_votes_data, "pagination": True, "source": "https://members.parliament.uk/member/{id}/voting", "latest_record_field": "id", "latest_record_date_field": "date"},
+            # "Submitted Written Questions": {"path": "{id}/WrittenQuestions?", "function": store_written_questions_data, "pagination": True, "source": "https://members.parliament.uk/member/{id}/writtenquestions", "latest_record_field": "uin", "latest_record_date_field": "dateTabled"},
         },
     },
 }
 
 
-def transform_to_text(data):
-    result = []
-    
-    if not isinstance(data, str):
-        for section, content in data.items():
-
-            if isinstance(content, dict):
-                section_text = f"{section}:\n"
-
-                for key, value in content.items():
-                    if isinstance(value, dict):
-                        section_text += f"  {key}:\n"
-                        for sub_key, sub_value in value.items():
-                            section_text += f"    {sub_key}: {sub_value}\n"
-
-                    else:
-                        section_text += f"  {key}: {value}\n"
-            else:
-                section_text = f"{section}: {content}\n"
-            
-            result.append(section_text)
-        
-        return "\n".join(result)
-    
-    else:
-        return data
-
-
-def prepare_data_for_upsert(metadata, source, batch_records):
-    text_data = transform_to_text(metadata)
-    id = hashlib.md5(text_data.encode()).hexdigest()
-
-    embedding, tokens_used = get_embedding(text_data)
-    
-    batch_records.append((id, embedding, {"text": text_data, "data_source": source}))
-
-    return batch_records
-
-
 def save_raw_data_db(mp_name, mp_id, mp_data):
     # Extract only whats needed, into a summary dictionary
 
@@ -446,6 +343,10 @@ def save_raw_data_db(mp_name, mp_id, mp_data):
         if social_media in mp_data["Parliament"]["Contact Details"]:
             mp_summary[social_media] = mp_data["Parliament"]["Contact Details"][social_media]["url"]
 
+    # Precomputed context for the chat's PERSONAL redirect (in the same format as retrieved records), so it doesn't need a retrieval
+    contact_source = parliament_api["Members"]["apis"]["Contact Details"]["source"].replace("{id}", str(mp_id))
+    mp_summary["Contact Context"] = f"---\nSource: {contact_source}\n{ingestion_utils.transform_to_text(ingestion_utils.clean_value_types(mp_data['Parliament']['Contact Details']))}"
+
     # More complex behaviour
     # Elections
     mp_summary["Elections"] = []
@@ -479,56 +380,16 @@ def store_mp_data(mp_name, mp_id, mp_data):
 
     # Store MP data in it's python form to Amazon DynamoDB
     save_raw_data_db(mp_name, mp_id, mp_data)
-    
-    # Change every entry of bool 'false' / 'true' to str "No" / "Yes"
-    mp_json_bool_cleaned_data = clean_value_types(mp_data)
-    mp_chunked_json_data = split_long_strings(mp_json_bool_cleaned_data, max_length=1000)
-
-    data_processing_types = {
-        "Group": ["Biography", "Synopsis", "General Details", "Contact Details", "Latest Election Details", "Registered Interests"],
-        "Separate": ["Spoken Contributions", "Submitted Written Questions", "Supported Early Day Motions", "Voting"],
-    }
-
-
-    records = []
-    for data_section, api_data_dict in parliament_api["Members"]["apis"].items():
-        if data_section in data_processing_types["Separate"]:
-            metadata = mp_chunked_json_data["Parliament"][data_section]
-            metadata_summary = {"subject": f"Summary of {data_section} topics"}
-            metadata_summary[f"Summary of {data_section} topics"] = []
 
-            for key, value in metadata.items():
-                if not isinstance(value, dict):
-                    metadata_summary[key] = value
-
-                else:
-                    metadata_summary[f"Summary of {data_section} topics"].append(key)
-
-            # Individual
-            for key, value in metadata.items():
-                if isinstance(value, dict):
-                    metadata_individual_record = {key: value, "subject": f"Individual record of {data_section} ({key})"}
-                    records = prepare_data_for_upsert(metadata_individual_record, api_data_dict["source"].replace("{id}", str(mp_id)), records)
-
-        elif data_section in data_processing_types["Group"]:
-            metadata = mp_chunked_json_data["Parliament"][data_section]
-            
-            records = prepare_data_for_upsert(metadata, api_data_dict["source"].replace("{id}", str(mp_id)), records)
-
-
-    batch_upsert_data(records, mp_name)
+    # clean -> chunk -> text -> embed -> upsert runs as a generator pipeline, so only a bounded window of records is held at once
+    # and embedding overlaps with upserting
+    mp_records = ingestion_utils.iter_mp_records(mp_id, mp_data, parliament_api["Members"]["apis"])
+    return batch_upsert_data(ingestion_utils.embed_records(mp_records, mp_name, client_openai, dense_index, embedding_cache, INGESTION_DIFF_MODE), mp_name)
 
 
 def send_api_request(url):
-    response = requests.get(url)
-   
-    if response.status_code == 200:
-        data = response.json()
-        return data
-    
-    else:
-        print(f"{url}\nError: {response.status_code}\n\n---------------")
-        return None
+    # Pooled, conditional GET - an unchanged resource comes back as a 304 and is served from the local response cache
+    return ingestion_utils.get_json(url)
 
 
 # Manually get the member IDs
@@ -538,67 +399,79 @@ mp_list = [
     {"Name": "Tom Hayes", "ID": 5210}, # Bournemouth East MP
 ]
 
-mp_daily_update_table = boto_utils.dynamodb_init("mp-daily-update-records")
 
-def collect_mp_data(mps_to_query):
-    for member_dict in mps_to_query:
+def collect_mp_data(member_dict):
+    # Structure of naming conventions for the dictionary is somewhat intentionally strange due to way it will eventually be converted to JSON and then flattened
+    # Query all of the APIs for the 'member' type and store according to functions
 
-        # Structure of naming conventions for the dictionary is somewhat intentionally strange due to way it will eventually be converted to JSON and then flattened
-        # Query all of the APIs for the 'member' type and store according to functions
+    mp_data = {}
+    mp_data_source_parliament = {}
 
-        mp_data = {}
-        mp_data_source_parliament = {}
+    api_type = "Members"
 
-        api_type = "Members"
+    mp_latest_records_dict = {}
 
-        mp_latest_records_dict = {
-            "mp_name": member_dict["Name"],
-        }
+    for name, api_dict in parliament_api[api_type]["apis"].items():
+        append_id_url = api_dict["path"].replace("{id}", str(member_dict["ID"]))
+        api_url = f"{parliament_api[api_type]['base_url']}{append_id_url}"
 
-        for name, api_dict in parliament_api[api_type]["apis"].items():
-            append_id_url = api_dict["path"].replace("{id}", str(member_dict["ID"]))
-            api_url = f"{parliament_api[api_type]['base_url']}{append_id_url}"
-
-            data = None
-
-            if api_dict["pagination"]:
-                counter = 1
-                # Do first page separately
-                page_data = send_api_request(f"{api_url}page={counter}")
-                first_page_entry = page_data
-
-                if page_data["items"]:
-                    # First checking if any records exist
-                    latest_record_identifier = page_data["items"][0]["value"][api_dict["latest_record_field"]]
-                    mp_latest_records_dict[api_dict["path"]] = latest_record_identifier
-                else:
-                    mp_latest_records_dict[api_dict["path"]] = "None"
-
-                while page_data["items"]:
-                    counter +=1
-                    page_data = send_api_request(f"{api_url}page={counter}")
-                    
-                    for item in page_data["items"]:
-                        first_page_entry["items"].append(item)
-
-                    time.sleep(0.1)
-                
-                data = first_page_entry
+        data = None
 
+        if api_dict["pagination"]:
+            # Page count is discovered from the first page, remaining pages are fetched concurrently (rate limited per host)
+            data = ingestion_utils.fetch_all_pages(api_url)
 
+            # A full rebuild with pages missing would store (and set watermarks from) an incomplete dataset, so the MP is retried instead
+            if not data["complete"]:
+                raise ingestion_utils.IngestionError(f"Failed to fetch every page of {api_dict['path']} ({len(data['items'])} of {data['totalResults']} records)")
+
+            if data["items"]:
+                # First checking if any records exist
+                latest_record_identifier = data["items"][0]["value"][api_dict["latest_record_field"]]
+                mp_latest_records_dict[api_dict["path"]] = latest_record_identifier
+                # Lets the daily delta sync stop paging at this date, even if the record above is later removed
+                mp_latest_records_dict[f"{api_dict['path']} Date"] = data["items"][0]["value"].get(api_dict["latest_record_date_field"]) or "None"
             else:
-                data = send_api_request(api_url)
+                mp_latest_records_dict[api_dict["path"]] = "None"
+                mp_latest_records_dict[f"{api_dict['path']} Date"] = "None"
+
 
-            mp_data_source_parliament[name] = api_dict["function"](member_dict["ID"], data)
-            time.sleep(0.1)
+        else:
+            data = send_api_request(api_url)
 
-        
-        boto_utils.dynamodb_upload_record(data=mp_latest_records_dict, table=mp_daily_update_table)
-        
-        mp_data["Parliament"] = mp_data_source_parliament
+        mp_data_source_parliament[name] = api_dict["function"](member_dict["ID"], data)
+        time.sleep(0.1)
 
-        store_mp_data(member_dict["Name"], member_dict["ID"], mp_data)
 
+    mp_data["Parliament"] = mp_data_source_parliament
+
+    store_stats = store_mp_data(member_dict["Name"], member_dict["ID"], mp_data)
+
+    # Invalidates the app's cached answers for this MP (see utils/cache_utils.py)
+    mp_latest_records_dict["Data Version"] = str(datetime.now())
+
+    # Watermarks are written in a single update, only once the records they cover are stored
+    if mp_latest_records_dict:
+        boto_utils.dynamodb_update_record(boto_utils.dynamodb_init_per_thread("mp-daily-update-records"), "mp_name", member_dict["Name"], mp_latest_records_dict)
+
+    return store_stats
+
+
+def lambda_handler(event, context):
+    # Covers every sitting MP unless given an explicit "mps" list. Large runs can be split across invocations with "shard_index" / "shard_count"
+    # and are resumable - MPs already completed in this month's run (per mp-daily-update-records) are skipped.
+    mps_to_query = event.get("mps") or ingestion_utils.get_current_mps()
+    mps_shard = ingestion_utils.get_shard(mps_to_query, event.get("shard_index", 0), event.get("shard_count", 1))
+
+    return ingestion_utils.run_mp_ingestion(
+        collect_mp_data,
+        mps_shard,
+        run_type="Monthly",
+        run_id=event.get("run_id", datetime.now().strftime("%Y-%m")),
+        checkpoint_table_name="mp-daily-update-records",
+        lambda_context=context,
+    )
 
 
-collect_mp_data(mp_list)
\ No newline at end of file
+if __name__ == "__main__":
+    lambda_handler({"mps": mp_list}, None)
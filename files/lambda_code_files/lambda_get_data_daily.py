@@ -1,13 +1,13 @@
 
-import requests
 import time
 import json
 from openai import OpenAI
 from pinecone import Pinecone, ServerlessSpec
 from dotenv import load_dotenv
 import os
-import hashlib
+from datetime import datetime
 import utils.boto_utils as boto_utils
+import utils.ingestion_utils as ingestion_utils
 
 load_dotenv()
 
@@ -29,82 +29,20 @@ if index_name not in pc.list_indexes().names():
 
 dense_index = pc.Index(index_name)
 
-
-def get_embedding(text):
-    response = client_openai.embeddings.create(
-        model="text-embedding-3-small",
-        input=text,
-    )
-
-    return response.data[0].embedding, response.usage.total_tokens
-
-
-def split_text(text, max_length=1000):
-    words = text.split()
-    chunks = []
-    current_chunk = []
-
-    for word in words:
-        if len(" ".join(current_chunk + [word])) > max_length:
-            chunks.append(" ".join(current_chunk))
-            current_chunk = [word]
-        else:
-            current_chunk.append(word)
-
-    if current_chunk:
-        chunks.append(" ".join(current_chunk))
-
-
-    return chunks
-
-
-def split_long_strings(obj, max_length=1000):
-    if isinstance(obj, dict):
-        for key, value in obj.items():
-            if isinstance(value, str) and len(value) > max_length:
-                obj[key] = split_text(value, max_length)
-
-            else:
-                split_long_strings(value, max_length)
-
-    elif isinstance(obj, list):
-        for item in obj:
-            split_long_strings(item, max_length)
-
-    return obj
-
-
-def clean_value_types(data):
-    if isinstance(data, dict):
-        return {key: clean_value_types(value) for key, value in data.items()}
-    
-    elif isinstance(data, list):
-        return [clean_value_types(item) for item in data]
-    
-    elif isinstance(data, bool):
-        return "Yes" if data else "No"
-    
-    elif data is None:
-        return ""
-    
-    elif isinstance(data, int) or isinstance(data, float):
-        return str(data)
-    
-    else:
-        return data
+# Diff mode: only embed/upsert records whose content hash isn't already in the MP's namespace
+INGESTION_DIFF_MODE = os.getenv("INGESTION_DIFF_MODE", "True") == "True"
+embedding_cache = ingestion_utils.embedding_cache_init()
+ingestion_utils.http_cache_init()
 
 
 def batch_upsert_data(records, mp_name):
-    batches = []
-    batch_size = 100
-    
-    # Create batches of batch_size records
-    for i in range(0, len(records), batch_size):
-        batch = records[i:i + batch_size]
-        batches.append(batch)
+    # records can be any iterable (e.g. embed_records' generator), batches are sent concurrently as records arrive
+    # Raises ingestion_utils.IngestionError if any records still fail to upsert after retrying
+    with ingestion_utils.StreamingUpserter(dense_index, namespace=mp_name) as upserter:
+        for record in records:
+            upserter.add(record)
 
-    for current_batch in batches:
-        dense_index.upsert(current_batch, namespace=mp_name)
+    return upserter.stats
 
 
 def safe_get_nested(top_dict, nested_dict_key, default_value=None):
@@ -119,19 +57,18 @@ def store_early_day_motions_sponsored(_, data):
 
     mp_early_day_motions = {}
 
-    for edm_dict in data["items"]:
-        time.sleep(0.1)
-        edm_url = edm_dict["links"][0]["href"][:-5]
+    # Fetch every EDM detail page concurrently up front (retried on 429/5xx), results come back in the same order as data["items"]
+    edm_urls = [edm_dict["links"][0]["href"][:-5] for edm_dict in data["items"]]
+    edm_urls_data = ingestion_utils.fetch_all_json(edm_urls)
+
+    for edm_dict, edm_url, edm_url_data in zip(data["items"], edm_urls, edm_urls_data):
 
         mp_early_day_motions[edm_dict["value"]["title"]] = {
             "Date Motion Tabled": edm_dict["value"]["dateTabled"],
             "Number of Sponsors": edm_dict["value"]["sponsorsCount"],
         }
 
-        response = requests.get(edm_url)
-        if response.status_code == 200:
-            edm_url_data = response.json()
-
+        if edm_url_data:
             mp_early_day_motions[edm_dict["value"]["title"]]["Motion Text"] = edm_url_data["Response"]["MotionText"]
             mp_early_day_motions[edm_dict["value"]["title"]]["Primary Sponsor"] = edm_url_data["Response"]["PrimarySponsor"]["Name"]
             mp_early_day_motions[edm_dict["value"]["title"]]["Primary Sponsor Party"] = edm_url_data["Response"]["PrimarySponsor"]["Party"]
@@ -139,7 +76,7 @@ def store_early_day_motions_sponsored(_, data):
             mp_early_day_motions[edm_dict["value"]["title"]]["All Sponsors"] = {sponsor["Member"]["Name"] for sponsor in edm_url_data["Response"]["Sponsors"]}
 
         else:
-            print(f"{edm_url}\nError: {response.status_code}\n\n---------------")
+            print(f"{edm_url}\nError: No detail data collected\n\n---------------")
 
 
     return mp_early_day_motions
@@ -150,9 +87,11 @@ def store_contribution_summary(member_id, data):
 
     mp_contributions = {}
 
-    for contributions_dict in data["items"]:
-        time.sleep(0.1)
-        contribution_url = contributions_dict["links"][0]["href"]
+    # Fetch every debate page concurrently up front (retried on 429/5xx), results come back in the same order as data["items"]
+    contribution_urls = [contributions_dict["links"][0]["href"] for contributions_dict in data["items"]]
+    contribution_urls_data = ingestion_utils.fetch_all_json(contribution_urls)
+
+    for contributions_dict, contribution_url, contribution_url_data in zip(data["items"], contribution_urls, contribution_urls_data):
 
         mp_contributions[contributions_dict["value"]["debateTitle"]] = {
             "Total Contributions To Debate": contributions_dict["value"]["totalContributions"],
@@ -168,10 +107,7 @@ def store_contribution_summary(member_id, data):
             "Contributions": {},
         }
 
-        response = requests.get(contribution_url)
-        if response.status_code == 200:
-            contribution_url_data = response.json()
-
+        if contribution_url_data:
             for index, contribution in enumerate(contribution_url_data["Items"]):
                 contribution_counter = 1
 
@@ -196,7 +132,7 @@ def store_contribution_summary(member_id, data):
                     contribution_counter += 1
 
         else:
-            print(f"{contribution_url}\nError: {response.status_code}\n\n---------------")
+            print(f"{contribution_url}\nError: No detail data collected\n\n---------------")
 
     return mp_contributions
 
@@ -258,56 +194,15 @@ parliament_api = {
     "Members": {
         "base_url": "https://members-api.parliament.uk/api/Members/",
         "apis": {
-            "Supported Early Day Motions": {"path": "{id}/Edms?", "function": store_early_day_motions_sponsored, "pagination": True, "source": "https://members.parliament.uk/member/{id}/earlydaymotions", "latest_record_field": "id"},
-            "Spoken Contributions": {"path": "{id}/ContributionSummary?", "function": store_contribution_summary, "pagination": True, "source": "https://members.parliament.uk/member/{id}/contributions", "latest_record_field": "debateId"},
-            "Voting": {"path": "{id}/Voting?house=1&", "function": store_votes_data, "pagination": True, "source": "https://members.parliament.uk/member/{id}/voting", "latest_record_field": "id"},
-            "Submitted Written Questions": {"path": "{id}/WrittenQuestions?", "function": store_written_questions_data, "pagination": True, "source": "https://members.parliament.uk/member/{id}/writtenquestions", "latest_record_field": "uin"},
+            "Supported Early Day Motions": {"path": "{id}/Edms?", "function": store_early_day_motions_sponsored, "pagination": True, "source": "https://members.parliament.uk/member/{id}/earlydaymotions", "latest_record_field": "id", "latest_record_date_field": "dateTabled"},
+            "Spoken Contributions": {"path": "{id}/ContributionSummary?", "function": store_contribution_summary, "pagination": True, "source": "https://members.parliament.uk/member/{id}/contributions", "latest_record_field": "debateId", "latest_record_date_field": "sittingDate"},
+            "Voting": {"path": "{id}/Voting?house=1&", "function": store_votes_data, "pagination": True, "source": "https://members.parliament.uk/member/{id}/voting", "latest_record_field": "id", "latest_record_date_field": "date"},
+            "Submitted Written Questions": {"path": "{id}/WrittenQuestions?", "function": store_written_questions_data, "pagination": True, "source": "https://members.parliament.uk/member/{id}/writtenquestions", "latest_record_field": "uin", "latest_record_date_field": "dateTabled"},
         },
     },
 }
 
 
-def transform_to_text(data):
-    result = []
-    
-    if not isinstance(data, str):
-        for section, content in data.items():
-
-            if isinstance(content, dict):
-                section_text = f"{section}:\n"
-
-                for key, value in content.items():
-                    if isinstance(value, dict):
-                        section_text += f"  {key}:\n"
-                        for sub_key, sub_value in value.items():
-                            section_text += f"    {sub_key}: {sub_value}\n"
-
-                    else:
-                        section_text += f"  {key}: {value}\n"
-            else:
-                section_text = f"{section}: {content}\n"
-            
-            result.append(section_text)
-        
-        return "\n".join(result)
-    
-    else:
-        return data
-
-
-def prepare_data_for_upsert(metadata, source, batch_records):
-    text_data = transform_to_text(metadata)
-    id = hashlib.md5(text_data.encode()).hexdigest()
-
-    embedding, tokens_used = get_embedding(text_data)
-
-    print(f"Batching for upsert: {text_data}")
-    
-    batch_records.append((id, embedding, {"text": text_data, "data_source": source}))
-
-    return batch_records
-
-
 def save_raw_data_db(mp_name, mp_id, mp_data):
     # Extract only whats needed, into a summary dictionary
 
@@ -360,172 +255,149 @@ def store_mp_data(mp_name, mp_id, mp_data):
 
     # Store MP data in it's python form to Amazon DynamoDB
     # save_raw_data_db(mp_name, mp_id, mp_data)
-    
-    # Change every entry of bool 'false' / 'true' to str "No" / "Yes"
-    mp_json_bool_cleaned_data = clean_value_types(mp_data)
-    mp_chunked_json_data = split_long_strings(mp_json_bool_cleaned_data, max_length=1000)
 
-    data_processing_types = {
-        "Group": ["Biography", "Synopsis", "General Details", "Contact Details", "Latest Election Details", "Registered Interests"],
-        "Separate": ["Spoken Contributions", "Submitted Written Questions", "Supported Early Day Motions", "Voting"],
-    }
+    # clean -> chunk -> text -> embed -> upsert runs as a generator pipeline, so only a bounded window of records is held at once
+    # and embedding overlaps with upserting
+    mp_records = ingestion_utils.iter_mp_records(mp_id, mp_data, parliament_api["Members"]["apis"])
+    return batch_upsert_data(ingestion_utils.embed_records(mp_records, mp_name, client_openai, dense_index, embedding_cache, INGESTION_DIFF_MODE), mp_name)
 
 
-    records = []
-    for data_section, api_data_dict in parliament_api["Members"]["apis"].items():
-        if data_section in data_processing_types["Separate"]:
+def send_api_request(url):
+    # Pooled, conditional GET - an unchanged resource comes back as a 304 and is served from the local response cache
+    return ingestion_utils.get_json(url)
 
-            if data_section in mp_chunked_json_data["Parliament"]:
-                metadata = mp_chunked_json_data["Parliament"][data_section]
-                # metadata_summary = {"subject": f"Summary of {data_section} topics"}
-                # metadata_summary[f"Summary of {data_section} topics"] = []
 
-                # for key, value in metadata.items():
-                #     if not isinstance(value, dict):
-                #         metadata_summary[key] = value
+# Manually get the member IDs
+mp_list = [
+    {"Name": "Paul Holmes", "ID": 4803}, # Hamble Valley MP
+    {"Name": "Jessica Toale", "ID": 5202}, # Bournemouth West MP
+    {"Name": "Tom Hayes", "ID": 5210}, # Bournemouth East MP
+]
 
-                #     else:
-                #         metadata_summary[f"Summary of {data_section} topics"].append(key)
 
-                # Individual
-                for key, value in metadata.items():
-                    if isinstance(value, dict):
-                        metadata_individual_record = {key: value, "subject": f"Individual record of {data_section} ({key})"}
-                        records = prepare_data_for_upsert(metadata_individual_record, api_data_dict["source"].replace("{id}", str(mp_id)), records)
+def collect_mp_data(member_dict):
+    # Structure of naming conventions for the dictionary is somewhat intentionally strange due to way it will eventually be converted to JSON and then flattened
+    # Query all of the APIs for the 'member' type and store according to functions
 
-        elif data_section in data_processing_types["Group"]:
-            metadata = mp_chunked_json_data["Parliament"][data_section]
-            
-            records = prepare_data_for_upsert(metadata, api_data_dict["source"].replace("{id}", str(mp_id)), records)
+    mp_data = {}
+    mp_data_source_parliament = {}
 
+    api_type = "Members"
 
-    batch_upsert_data(records, mp_name)
+    mp_daily_update_table = boto_utils.dynamodb_init_per_thread("mp-daily-update-records")
 
+    mp_new_latest_records_dict = {}
+    store_stats = None
+    # Endpoints where a page failed before the watermark was reached
+    incomplete_paths = []
+    # MPs new to the full-House run may not have any stored records yet
+    mp_latest_records = boto_utils.dynamodb_fetch_record(mp_daily_update_table, "mp_name", member_dict["Name"]) or {}
 
-def send_api_request(url):
-    response = requests.get(url)
-   
-    if response.status_code == 200:
-        data = response.json()
-        return data
-    
-    else:
-        print(f"{url}\nError: {response.status_code}\n\n---------------")
-        return None
 
+    for name, api_dict in parliament_api[api_type]["apis"].items():
+        append_id_url = api_dict["path"].replace("{id}", str(member_dict["ID"]))
+        api_url = f"{parliament_api[api_type]['base_url']}{append_id_url}"
 
-mp_daily_update_table = boto_utils.dynamodb_init("mp-daily-update-records")
+        data = None
 
+        if api_dict["pagination"]:
+            # Do first page separately
+            page_data = send_api_request(f"{api_url}page=1")
 
-# Manually get the member IDs
-mp_list = [
-    {"Name": "Paul Holmes", "ID": 4803}, # Hamble Valley MP
-    {"Name": "Jessica Toale", "ID": 5202}, # Bournemouth West MP
-    {"Name": "Tom Hayes", "ID": 5210}, # Bournemouth East MP
-]
+            # A failed request (an endpoint with no records still returns a page, with an empty "items" list) - the endpoint's watermark
+            # isn't moved on and the MP isn't checkpointed, so it's retried
+            if not page_data:
+                print(f"[{member_dict["Name"]}]: Failed to fetch the first page of {api_dict["path"]}")
+                incomplete_paths.append(api_dict["path"])
+                continue
 
-def collect_mp_data(mps_to_query):
-    for member_dict in mps_to_query:
+            # Watermarks for this endpoint - the newest record ingested and the date it was tabled / sat / voted
+            latest_record_field = api_dict["latest_record_field"]
+            latest_record_date_field = api_dict["latest_record_date_field"]
+            database_latest_record_identifier = int(mp_latest_records[api_dict["path"]]) if mp_latest_records.get(api_dict["path"], "None") != "None" else "None"
+            database_latest_record_date = mp_latest_records.get(f"{api_dict['path']} Date", "None")
 
-        # Structure of naming conventions for the dictionary is somewhat intentionally strange due to way it will eventually be converted to JSON and then flattened
-        # Query all of the APIs for the 'member' type and store according to functions
+            if page_data["items"]:
+                # First checking if any records exist
+                search_latest_record_identifier = int(page_data["items"][0]["value"][latest_record_field])
+            else:
+                search_latest_record_identifier = "None"
 
-        mp_data = {}
-        mp_data_source_parliament = {}
+            # Check first entry of first page is not already recorded
+            if (database_latest_record_identifier == search_latest_record_identifier):
+                print(f"[{member_dict["Name"]}]: Found latest record as first entry in first page {api_dict["path"]} -- {database_latest_record_identifier} == {search_latest_record_identifier}")
+                continue
 
-        api_type = "Members"
+            def is_already_stored(item):
+                if database_latest_record_identifier == int(item["value"][latest_record_field]):
+                    return True
 
-        mp_new_latest_records_dict = {
-            "mp_name": member_dict["Name"],
-        }
-        mp_latest_records = boto_utils.dynamodb_fetch_record(mp_daily_update_table, "mp_name", member_dict["Name"])
-
-
-        for name, api_dict in parliament_api[api_type]["apis"].items():
-            append_id_url = api_dict["path"].replace("{id}", str(member_dict["ID"]))
-            api_url = f"{parliament_api[api_type]['base_url']}{append_id_url}"
-
-            data = None
-
-            if api_dict["pagination"]:
-                counter = 1
-                # Do first page separately
-                page_data = send_api_request(f"{api_url}page={counter}")
-                first_page_entry = page_data
-
-                # breakpoint()
-
-                database_latest_record_identifier = int(mp_latest_records[api_dict["path"]]) if mp_latest_records[api_dict["path"]] != "None" else mp_latest_records[api_dict["path"]]
-
-                if page_data["items"]:
-                    # First checking if any records exist
-                    search_latest_record_identifier = int(page_data["items"][0]["value"][api_dict["latest_record_field"]])
-                    mp_new_latest_records_dict[api_dict["path"]] = search_latest_record_identifier
-                else:
-                    mp_new_latest_records_dict[api_dict["path"]] = "None"
-
-                
-                # Check first entry of first page is not already recorded
-                if (database_latest_record_identifier == search_latest_record_identifier):
-                    print(f"[{member_dict["Name"]}]: Found latest record as first entry in first page {api_dict["path"]} -- {database_latest_record_identifier} == {search_latest_record_identifier}")
-                    continue
-
-                skip_current_loop = False
-
-                first_page_entry = {"items": []}
-
-                # Now check every entry in first page is not already recorded, append records for upload until its found
-                for i, item in enumerate(page_data["items"]):
-                    time.sleep(1)
-                    if (database_latest_record_identifier == int(item["value"][api_dict["latest_record_field"]])):
-                        print(f"[{member_dict["Name"]}]: Found latest record in first page, ({i}) {api_dict["path"]} -- {database_latest_record_identifier} == {int(item["value"][api_dict["latest_record_field"]])}")
-                        skip_current_loop = True
-                        break
-                    
-                    first_page_entry["items"].append(item)
-                
-                # Need to add this flag so that if we found a record in the first page, skip the current loop and move onto next API rather than now storing every record for additional pages
-                if skip_current_loop:
-                    data = first_page_entry
-                    mp_data_source_parliament[name] = api_dict["function"](member_dict["ID"], data)
-                    # breakpoint()
-                    continue
-
-                # Now iteratively check every record in every other page, append records for upload until its found
-                # print(f"Not the same {api_dict["path"]} -- {database_latest_record_identifier} == {search_latest_record_identifier}")
-                while page_data["items"]:
-                    counter +=1
-                    page_data = send_api_request(f"{api_url}page={counter}")
-                    print(f"[{member_dict["Name"]}]: Requesting {api_url}page={counter}")
-                    
-                    for i, item in enumerate(page_data["items"]):
-                        if (database_latest_record_identifier == int(item["value"][api_dict["latest_record_field"]])):
-                            print(f"[{member_dict["Name"]}]: Found latest record in page {counter}, ({i}) {api_dict["path"]} -- {database_latest_record_identifier} == {search_latest_record_identifier}")
-                            continue
-                        
-                        first_page_entry["items"].append(item)
-
-                    time.sleep(0.1)
-                
-                data = first_page_entry
-            else:
-                data = send_api_request(api_url)
+                # Date cutoff - records are newest first, so anything older than the stored latest record's date was ingested by a previous run
+                # (this also stops paging if the stored latest record has since been removed from the API, e.g. a withdrawn question)
+                item_date = item["value"].get(latest_record_date_field)
+                return database_latest_record_date != "None" and bool(item_date) and item_date[:10] < database_latest_record_date[:10]
 
-            mp_data_source_parliament[name] = api_dict["function"](member_dict["ID"], data)
-            time.sleep(0.1)
+            # Stops paging as soon as the stored latest record is reached (further pages are only requested, a window at a time, if it isn't found)
+            delta_data = ingestion_utils.fetch_pages_until(api_url, is_already_stored, first_page=page_data)
+            print(f"[{member_dict["Name"]}]: Found {len(delta_data["items"])} new records in {delta_data["pagesFetched"]} pages of {api_dict["path"]}")
 
+            if delta_data["items"]:
+                data = {"items": delta_data["items"]}
+                mp_data_source_parliament[name] = api_dict["function"](member_dict["ID"], data)
 
-        if mp_data_source_parliament:
-            print(f"[{member_dict["Name"]}]: New data found, proceeding to store. {mp_data_source_parliament}")
-                
-            boto_utils.dynamodb_upload_record(data=mp_new_latest_records_dict, table=mp_daily_update_table)
-            
-            mp_data["Parliament"] = mp_data_source_parliament
-            store_mp_data(member_dict["Name"], member_dict["ID"], mp_data)
+            # Only move the watermark on if every page up to it was fetched, otherwise the missed records are retried next run
+            if not delta_data["complete"]:
+                incomplete_paths.append(api_dict["path"])
+
+            elif page_data["items"]:
+                mp_new_latest_records_dict[api_dict["path"]] = search_latest_record_identifier
+                mp_new_latest_records_dict[f"{api_dict['path']} Date"] = page_data["items"][0]["value"].get(latest_record_date_field) or "None"
 
         else:
-            print(f"[{member_dict["Name"]}]: No new data found, ending!")
+            data = send_api_request(api_url)
+            mp_data_source_parliament[name] = api_dict["function"](member_dict["ID"], data)
+
+
+    if mp_data_source_parliament:
+        print(f"[{member_dict["Name"]}]: New data found, proceeding to store. {mp_data_source_parliament}")
 
+        mp_data["Parliament"] = mp_data_source_parliament
+        # Raises if any record fails to upsert - the watermarks & Data Version below are then never written, so the old watermarks stay
+        # and the same records are fetched again by the retry
+        store_stats = store_mp_data(member_dict["Name"], member_dict["ID"], mp_data)
+
+        # Invalidates the app's cached answers for this MP (see utils/cache_utils.py)
+        mp_new_latest_records_dict["Data Version"] = str(datetime.now())
+
+    else:
+        print(f"[{member_dict["Name"]}]: No new data found, ending!")
+
+    # Every endpoint's watermark is written in a single update, only reached once every new record is confirmed stored
+    if mp_new_latest_records_dict:
+        boto_utils.dynamodb_update_record(mp_daily_update_table, "mp_name", member_dict["Name"], mp_new_latest_records_dict)
+
+    # The incomplete endpoints' watermarks weren't moved on, but the MP mustn't be checkpointed either, so a resumed run retries it
+    if incomplete_paths:
+        raise ingestion_utils.IngestionError(f"Failed to fetch every new page of {', '.join(incomplete_paths)}")
+
+    return store_stats
+
+
+def lambda_handler(event, context):
+    # Covers every sitting MP unless given an explicit "mps" list. Large runs can be split across invocations with "shard_index" / "shard_count"
+    # and are resumable - MPs already completed in today's run (per mp-daily-update-records) are skipped.
+    mps_to_query = event.get("mps") or ingestion_utils.get_current_mps()
+    mps_shard = ingestion_utils.get_shard(mps_to_query, event.get("shard_index", 0), event.get("shard_count", 1))
+
+    return ingestion_utils.run_mp_ingestion(
+        collect_mp_data,
+        mps_shard,
+        run_type="Daily",
+        run_id=event.get("run_id", datetime.now().strftime("%Y-%m-%d")),
+        checkpoint_table_name="mp-daily-update-records",
+        lambda_context=context,
+    )
 
 
-collect_mp_data(mp_list)
\ No newline at end of file
+if __name__ == "__main__":
+    lambda_handler({"mps": mp_list}, None)
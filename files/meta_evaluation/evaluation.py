@@ -3,6 +3,8 @@ from langchain_core.messages import SystemMessage
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 from collections import namedtuple
+import argparse
+import time
 
 import utils.rag_llm_utils as rag_llm_utils
 import utils.constants as constants
@@ -242,9 +244,6 @@ preset_user = rag_llm_utils.User(competencies={
     "UK Government": "Nothing at all",
 })
 
-logs = {mp_dict["Name"]: {} for mp_dict in MPS}
-
-
 def evaluate_output(key_fact, current_question_version, current_response_version):
     return evaluation_chain.invoke({
         "key_fact": key_fact, 
@@ -253,8 +252,11 @@ def evaluate_output(key_fact, current_question_version, current_response_version
     })
 
 
-def evaluate_test_case_cycle(mp_name, mp_constituency, user, question, test_case, test_logs):
-    llm_response, _ = rag_llm_utils.ask_prompt(question, user, mp_name, mp_constituency)
+def evaluate_test_case_cycle(mp_name, mp_constituency, user, question, test_case, test_logs, answer_mode):
+    # Answer cache is off so every question is actually answered in the mode being evaluated
+    start_time = time.perf_counter()
+    llm_response, _ = rag_llm_utils.ask_prompt(question, user, mp_name, mp_constituency, answer_mode=answer_mode, use_answer_cache=False)
+    test_logs["Response Times"].append(time.perf_counter() - start_time)
 
     test_logs["Questions"].append(question)
     test_logs["Civic Sage Responses"].append(llm_response)
@@ -276,30 +278,53 @@ def evaluate_test_case_cycle(mp_name, mp_constituency, user, question, test_case
             return "Failed"
 
         print(f"[{mp_name}]: {test_case.subject.upper()} failed! Current attempt: {len(test_logs['Questions'])}")
-        return evaluate_test_case_cycle(mp_name, mp_constituency, user, evaluated_output.content, test_case, test_logs)
+        return evaluate_test_case_cycle(mp_name, mp_constituency, user, evaluated_output.content, test_case, test_logs, answer_mode)
+
+
+def run_evaluation(answer_mode):
+    # Each mode starts from a fresh chat history, so runs are comparable
+    rag_llm_utils.init(ch=rag_llm_utils.ChatHistory(size=20))
+
+    logs = {mp_dict["Name"]: {} for mp_dict in MPS}
+    test_results = {"Passed": [], "Failed": []}
+    response_times = []
+
+    for mp_test_suite in TESTS:
+
+        print(f"----------\n[!] Running all tests for {mp_test_suite.name} ({answer_mode})")
+
+        for test_case in mp_test_suite.tests:
+            print(f"[{mp_test_suite.name}]: Running {test_case.subject.upper()} test!")
+
+            logs_current_test = logs[mp_test_suite.name][test_case.subject] = {
+                "Fact": test_case.fact,
+                "Questions": [],
+                "Civic Sage Responses": [],
+                "Response Times": [],
+            }
 
+            flag = evaluate_test_case_cycle(mp_test_suite.name, mp_test_suite.constituency, preset_user, test_case.q, test_case, logs_current_test, answer_mode)
+            test_results[flag].append(f"{test_case.subject} ({mp_test_suite.name})")
+            response_times.extend(logs_current_test["Response Times"])
 
-test_results = {"Passed": [], "Failed": []}
+    num_tests_passed, num_tests_failed, num_total_tests = len(test_results["Passed"]), len(test_results["Failed"]), (len(test_results["Passed"]) + len(test_results["Failed"]))
+    print(f"\n\n--------------------\n[SUMMARY - {answer_mode}]:\n - Tests PASSED: {num_tests_passed}/{num_total_tests}")
+    print(f" - Tests FAILED: {num_tests_failed}/{num_total_tests}\n{test_results["Failed"]}" if test_results["Failed"] else f" - Tests FAILED: {num_tests_failed}/{num_total_tests}")
+    print(f" - Mean response time: {sum(response_times) / len(response_times):.2f}s over {len(response_times)} questions")
 
-for mp_test_suite in TESTS:
+    return {"Pass Rate": num_tests_passed / num_total_tests, "Mean Response Time": sum(response_times) / len(response_times), "Questions": len(response_times)}
 
-    print(f"----------\n[!] Running all tests for {mp_test_suite.name}")
 
-    for test_case in mp_test_suite.tests:
-        print(f"[{mp_test_suite.name}]: Running {test_case.subject.upper()} test!")
+parser = argparse.ArgumentParser(description="Run Civic Sage's 'intelligent' LLM-driven tests.")
+parser.add_argument("--mode", choices=[*rag_llm_utils.ANSWER_MODES, "compare"], default=rag_llm_utils.ANSWER_MODE, help="Answer mode to evaluate, or 'compare' to run every mode.")
+args = parser.parse_args()
 
-        logs_current_test = logs[mp_test_suite.name][test_case.subject] = {
-            "Fact": test_case.fact,
-            "Questions": [],
-            "Civic Sage Responses": [],
-        }
+answer_modes = rag_llm_utils.ANSWER_MODES if args.mode == "compare" else [args.mode]
+evaluation_results = {answer_mode: run_evaluation(answer_mode) for answer_mode in answer_modes}
 
-        flag = evaluate_test_case_cycle(mp_test_suite.name, mp_test_suite.constituency, preset_user, test_case.q, test_case, logs_current_test)
-        test_results[flag].append(f"{test_case.subject} ({mp_test_suite.name})")
-        
+if len(evaluation_results) > 1:
+    print(f"\n\n--------------------\n[COMPARISON]:\n{'Mode':<10} {'Pass rate':>10} {'Mean response time (s)':>23} {'Questions':>10}")
+    for answer_mode, results in evaluation_results.items():
+        print(f"{answer_mode:<10} {results['Pass Rate']:>10.0%} {results['Mean Response Time']:>23.2f} {results['Questions']:>10}")
 
-num_tests_passed, num_tests_failed, all_tests_failed, num_total_tests = len(test_results["Passed"]), len(test_results["Failed"]), test_results["Failed"], (len(test_results["Passed"]) + len(test_results["Failed"]))
-print(f"\n\n--------------------\n[SUMMARY]:\n - Tests PASSED: {num_tests_passed}/{num_total_tests}")
-print(f" - Tests FAILED: {num_tests_failed}/{num_total_tests}\n{test_results["Failed"]}" if test_results["Failed"] else f" - Tests FAILED: {num_tests_failed}/{num_total_tests}")
-        
-print("\n[CAVEATS]:\n - These intelligent tests are based on retrieving factual information from Civic Sage and rely on statically inputted information (correct as of April 2025).\n - It is possible that some MPs information (e.g. roles) may have changed since then, potentially causing tests to fail.")
\ No newline at end of file
+print("\n[CAVEATS]:\n - These intelligent tests are based on retrieving factual information from Civic Sage and rely on statically inputted information (correct as of April 2025).\n - It is possible that some MPs information (e.g. roles) may have changed since then, potentially causing tests to fail.")
@@ -18,4 +18,21 @@ Feature: Anonymise sensitive information from text
   Scenario: Check name anonymisation omits MP name
     Given the input text is "My name is Paul Holmes"
     When I anonymise the text
-    Then the output should contain "Paul Holmes"
\ No newline at end of file
+    Then the output should contain "Paul Holmes"
+
+  Scenario: Check a question with a name contains personal data
+    Given the input text is "My name is John Doe, what is my MP doing about potholes?"
+    When I check the text for personal data
+    Then it should contain personal data
+
+  Scenario: Check a question about the MP contains no personal data
+    Given the input text is "How did Paul Holmes vote on the Rwanda bill?"
+    When I check the text for personal data
+    Then it should not contain personal data
+
+  Scenario: Check batch anonymisation matches anonymising each text
+    Given the input texts are "My name is John Doe" and "I asked Paul Holmes about my road, call me on 07700 900123"
+    When I anonymise the texts together
+    Then each output should match anonymising the text alone
+    And output 1 should contain "<PERSON>"
+    And output 2 should contain "Paul Holmes"
@@ -0,0 +1,22 @@
+Feature: Semantic answer cache
+  As the LLM wrapper
+  I want to reuse stored answers for near-duplicate questions about the same MP
+  So that repeated questions don't pay for retrieval and LLM calls again.
+
+  Scenario: Near-duplicate question is answered from the cache
+    Given I have an empty answer cache
+    And I have cached the answer "They are a Conservative MP." for "Paul Holmes" with competency "Beginner"
+    When I look up a near-duplicate question for "Paul Holmes" with competency "Beginner"
+    Then the cached answer should be "They are a Conservative MP."
+
+  Scenario: Cached answers are not shared between competencies
+    Given I have an empty answer cache
+    And I have cached the answer "They are a Conservative MP." for "Paul Holmes" with competency "Beginner"
+    When I look up a near-duplicate question for "Paul Holmes" with competency "Expert"
+    Then there should be no cached answer
+
+  Scenario: Cached answers are not shared between MPs
+    Given I have an empty answer cache
+    And I have cached the answer "They are a Conservative MP." for "Paul Holmes" with competency "Beginner"
+    When I look up a near-duplicate question for "Tom Hayes" with competency "Beginner"
+    Then there should be no cached answer
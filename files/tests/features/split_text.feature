@@ -0,0 +1,21 @@
+Feature: Chunking long text for ingestion
+  As the ingestion pipeline
+  I want to split long strings into bounded chunks
+  So that each record fits within the embedding limits.
+
+  Scenario: Chunks never exceed the maximum length
+    Given the text to chunk is "The honourable member for Hamble Valley asked the minister about housing funding in the constituency"
+    When I split the text with a maximum length of 30
+    Then every chunk should be at most 30 characters
+    And the chunks should contain every word in order
+
+  Scenario: Short text is kept as one chunk
+    Given the text to chunk is "A short question"
+    When I split the text with a maximum length of 1000
+    Then there should be 1 chunk
+
+  Scenario: Overlap repeats the end of the previous chunk
+    Given the text to chunk is "one two three four five six seven eight"
+    When I split the text with a maximum length of 14 and an overlap of 5
+    Then every chunk should be at most 14 characters
+    And each chunk after the first should start with the last word of the previous chunk
@@ -22,4 +22,46 @@ def output_should_contain(context, expected):
 
 @then(parsers.parse('the output should not contain "{not_expected}"'))
 def output_should_not_contain(context, not_expected):
-    assert not_expected not in context["anon_output"], f'Did not expect "{not_expected}" in "{context["anon_output"]}"'
\ No newline at end of file
+    assert not_expected not in context["anon_output"], f'Did not expect "{not_expected}" in "{context["anon_output"]}"'
+
+@when("I check the text for personal data")
+def check_personal_data(context):
+    context["contains_personal_data"] = analysis_utils.contains_personal_data(context["input_text"], mp_name="Paul Holmes")
+
+@then("it should contain personal data")
+def should_contain_personal_data(context):
+    assert context["contains_personal_data"], f'Expected personal data to be found in "{context["input_text"]}"'
+
+@then("it should not contain personal data")
+def should_not_contain_personal_data(context):
+    assert not context["contains_personal_data"], f'Did not expect personal data to be found in "{context["input_text"]}"'
+
+@given(parsers.parse('the input texts are "{text_a}" and "{text_b}"'))
+def input_texts(context, text_a, text_b):
+    context["input_texts"] = [text_a, text_b]
+
+@when("I anonymise the texts together")
+def anonymize_texts(context):
+    context["anon_outputs"] = analysis_utils.anonymize_texts(context["input_texts"], mp_name="Paul Holmes")
+
+def anonymize_text_reference(text, mp_name):
+    # Independent of anonymize_texts - one analyzer.analyze call per text, as in the original implementation
+    results = analysis_utils.get_analyzer().analyze(text=text, entities=[], language="en")
+    mp_name_allowlist = [mp_name, f"{mp_name}'s", f"{mp_name}s", f"{mp_name} MP", f"MP {mp_name}"]
+
+    filtered_results = [
+        result for result in results
+        if result.entity_type not in ["DATE_TIME", "NRP", "LOCATION", "URL"]
+        and not (result.entity_type == "PERSON" and text[result.start:result.end] in mp_name_allowlist)
+    ]
+
+    return analysis_utils.get_anonymizer().anonymize(text=text, analyzer_results=filtered_results).text
+
+@then("each output should match anonymising the text alone")
+def outputs_should_match(context):
+    for text, anon_output in zip(context["input_texts"], context["anon_outputs"], strict=True):
+        assert anon_output == anonymize_text_reference(text, mp_name="Paul Holmes"), f'Batch output "{anon_output}" differs for "{text}"'
+
+@then(parsers.parse('output {number:d} should contain "{expected}"'))
+def numbered_output_should_contain(context, number, expected):
+    assert expected in context["anon_outputs"][number - 1], f'Expected "{expected}" to be in "{context["anon_outputs"][number - 1]}"'
@@ -0,0 +1,39 @@
+from pytest_bdd import scenarios, given, when, then, parsers
+import pytest
+import numpy as np
+import utils.cache_utils as cache_utils
+
+scenarios("features/answer_cache.feature")
+
+# Unit length stand-ins for question embeddings, with a cosine similarity of ~0.99
+QUESTION_EMBEDDING = np.array([1.0, 0.0, 0.0])
+NEAR_DUPLICATE_QUESTION_EMBEDDING = np.array([0.99, 0.141, 0.0])
+
+@pytest.fixture
+def context():
+    return {}
+
+@pytest.fixture(autouse=True)
+def data_version(monkeypatch):
+    # SemanticAnswerCache.get checks the MP's Data Version in DynamoDB - a fixed version keeps the test offline
+    monkeypatch.setattr(cache_utils, "get_mp_data_version", lambda mp_name: "Test Version")
+
+@given("I have an empty answer cache")
+def empty_answer_cache(context):
+    context["answer_cache"] = cache_utils.SemanticAnswerCache()
+
+@given(parsers.parse('I have cached the answer "{answer}" for "{mp_name}" with competency "{competency}"'))
+def cache_answer(context, answer, mp_name, competency):
+    context["answer_cache"].add(mp_name, QUESTION_EMBEDDING, competency, answer)
+
+@when(parsers.parse('I look up a near-duplicate question for "{mp_name}" with competency "{competency}"'))
+def look_up_answer(context, mp_name, competency):
+    context["cached_answer"] = context["answer_cache"].get(mp_name, NEAR_DUPLICATE_QUESTION_EMBEDDING, competency)
+
+@then(parsers.parse('the cached answer should be "{expected_answer}"'))
+def check_cached_answer(context, expected_answer):
+    assert context["cached_answer"] == expected_answer, f"Expected '{expected_answer}', got '{context['cached_answer']}'"
+
+@then("there should be no cached answer")
+def check_no_cached_answer(context):
+    assert context["cached_answer"] is None, f"Expected no cached answer, got '{context['cached_answer']}'"
@@ -0,0 +1,38 @@
+from pytest_bdd import scenarios, given, when, then, parsers
+import pytest
+import utils.ingestion_utils as ingestion_utils
+
+scenarios("features/split_text.feature")
+
+@pytest.fixture
+def context():
+    return {}
+
+@given(parsers.parse('the text to chunk is "{text}"'))
+def text_to_chunk(context, text):
+    context["text"] = text
+
+@when(parsers.parse("I split the text with a maximum length of {max_length:d}"))
+def split_text(context, max_length):
+    context["chunks"] = ingestion_utils.split_text(context["text"], max_length)
+
+@when(parsers.parse("I split the text with a maximum length of {max_length:d} and an overlap of {overlap:d}"))
+def split_text_with_overlap(context, max_length, overlap):
+    context["chunks"] = ingestion_utils.split_text(context["text"], max_length, overlap=overlap)
+
+@then(parsers.parse("every chunk should be at most {max_length:d} characters"))
+def chunks_within_max_length(context, max_length):
+    assert all(len(chunk) <= max_length for chunk in context["chunks"]), f"Chunk longer than {max_length} in {context['chunks']}"
+
+@then("the chunks should contain every word in order")
+def chunks_contain_every_word(context):
+    assert " ".join(context["chunks"]).split() == context["text"].split(), f"Words lost or reordered in {context['chunks']}"
+
+@then(parsers.parse("there should be {number:d} chunk"))
+def number_of_chunks(context, number):
+    assert len(context["chunks"]) == number, f"Expected {number} chunk(s), got {context['chunks']}"
+
+@then("each chunk after the first should start with the last word of the previous chunk")
+def chunks_overlap(context):
+    for previous_chunk, chunk in zip(context["chunks"], context["chunks"][1:]):
+        assert chunk.split()[0] == previous_chunk.split()[-1], f"Expected '{chunk}' to overlap with '{previous_chunk}'"
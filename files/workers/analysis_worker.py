@@ -0,0 +1,65 @@
+# Worker which drains the conversation analysis queue (filled by analysis_utils.analyse_chat when a user leaves an MP's page),
+# analysing queued conversations in batches
+import argparse
+import time
+
+import utils.analysis_utils as analysis_utils
+
+# Conversations per batch - their user messages are all classified together
+ANALYSIS_BATCH_SIZE = 32
+POLL_INTERVAL_SECONDS = 5
+
+
+def process_batch(analysis_queue, batch_size=ANALYSIS_BATCH_SIZE):
+    messages = analysis_queue.receive_messages(max_messages=batch_size)
+
+    if not messages:
+        return 0
+
+    start_time = time.perf_counter()
+
+    try:
+        session_errors = analysis_utils.analyse_sessions([session_payload for _, session_payload in messages])
+
+    # Nothing was saved (e.g. the classifier failed to load), so messages aren't deleted - they're re-delivered (and retried) once
+    # their visibility timeout expires
+    except Exception as e:
+        print(f"[Analysis Worker]: Error analysing batch of {len(messages)} conversations: {e}")
+        return len(messages)
+
+    # Analysed conversations are deleted, and only the ones which failed are dead-lettered
+    analysis_queue.delete_messages([message_id for index, (message_id, _) in enumerate(messages) if index not in session_errors])
+
+    if session_errors:
+        for index, error in session_errors.items():
+            print(f"[Analysis Worker]: Error analysing conversation for {messages[index][1]['mp_name']}, dead-lettering it: {error}")
+
+        analysis_queue.dead_letter_messages([(messages[index][0], messages[index][1], str(error)) for index, error in session_errors.items()])
+
+    print(f"[Analysis Worker]: Analysed {len(messages) - len(session_errors)}/{len(messages)} conversations in {time.perf_counter() - start_time:.2f}s")
+
+    # Number received rather than analysed, so a failing batch doesn't stop --once before the queue is drained
+    return len(messages)
+
+
+def run_worker(run_once=False, batch_size=ANALYSIS_BATCH_SIZE):
+    analysis_queue = analysis_utils.get_analysis_queue()
+
+    while True:
+        processed = process_batch(analysis_queue, batch_size)
+
+        # Only sleep once the queue has been drained
+        if not processed:
+            if run_once:
+                break
+
+            time.sleep(POLL_INTERVAL_SECONDS)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyse queued conversations.")
+    parser.add_argument("--once", action="store_true", help="Drain the queue then exit, rather than polling for new conversations.")
+    parser.add_argument("--batch-size", type=int, default=ANALYSIS_BATCH_SIZE, help="Conversations analysed per batch.")
+    args = parser.parse_args()
+
+    run_worker(run_once=args.once, batch_size=args.batch_size)
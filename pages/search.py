@@ -8,6 +8,7 @@ from streamlit_extras.add_vertical_space import add_vertical_space
 
 import utils.streamlit_utils as st_utils
 import utils.location_utils as location_utils
+import utils.analysis_utils as analysis_utils
 
 st_utils.create_page_setup(page_name="Search")
 
@@ -44,6 +45,13 @@ def page_setup_search_llm():
         latitude, longitude = location_utils.get_location_by_streamlit()
         st.session_state.location = (latitude, longitude)
 
+    # Resolved once here, so only the user's ward & constituency (not their coordinates) are queued with the conversation
+    if "location_codes" not in st.session_state:
+        st.session_state.location_codes = location_utils.get_location_codes(*st.session_state.location)
+
+    # Presidio is loaded in the background while the user chats, ready to anonymise the conversation when they leave
+    analysis_utils.preload_anonymizer()
+
     if "usage_agreement" not in st.session_state:
         st_utils.usage_agreement_and_init_setup(CURRENT_MP)
 
@@ -59,12 +67,7 @@ def page_setup_search_llm():
     # Run chat history if a chat history exists (to prevent first-run error)
     if "chat_history" in st.session_state:
         # Send intro message, which is never logged as part of the chat history due to its independent send nature (outside of rag_llm_utils)
-        if "intro_sent" not in st.session_state:
-            # If no chat history, send the "start message" for the conversation.
-            st_utils.send_chat_message({"role": "ai", "message": AIMessage(f"Hi there! Feel free to ask me to explain any political information about {CURRENT_MP}!"), "time": datetime.now(), "message_index": None}, speak=True)
-            st.session_state.intro_sent = True
-        else:
-            st_utils.send_chat_message({"role": "ai", "message": AIMessage(f"Hi there! Feel free to ask me to explain any political information about {CURRENT_MP}!"), "time": datetime.now(), "message_index": None}, speak=False)
+        st_utils.send_chat_message({"role": "ai", "message": AIMessage(f"Hi there! Feel free to ask me to explain any political information about {CURRENT_MP}!"), "time": datetime.now(), "message_index": None})
 
 
         st_utils.process_chat_history()
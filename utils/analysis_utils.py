@@ -1,160 +1,424 @@
 from datetime import datetime
-import textstat
-from presidio_analyzer import AnalyzerEngine
-from presidio_anonymizer import AnonymizerEngine
+from types import SimpleNamespace
+import os
+import threading
 
-import utils.location_utils as location_utils
 import utils.boto_utils as boto_utils
 import utils.constants as constants
-
-analyzer = AnalyzerEngine()
-anonymizer = AnonymizerEngine()
-conversation_table = boto_utils.dynamodb_init("conversations")
+import utils.queue_utils as queue_utils
 
 import streamlit as st
 
-# @st.cache_resource
+# Presidio (which loads a spaCy model), the DynamoDB table & the analysis queue are only created on first use, rather than whenever this
+# module is imported (i.e. by every page)
+resources = {}
+# Re-entrant, as some resources are built from others (e.g. the batch analyzer wraps the analyzer)
+resources_lock = threading.RLock()
+
+
+def get_resource(name, create_resource):
+    # Created once per process, even if several sessions ask for it at the same time
+    if name not in resources:
+        with resources_lock:
+            if name not in resources:
+                print(f"[Analysis]: Loading {name}")
+                resources[name] = create_resource()
+
+    return resources[name]
+
+
+def get_analyzer():
+    from presidio_analyzer import AnalyzerEngine
+
+    return get_resource("Analyzer", AnalyzerEngine)
+
+
+def get_batch_analyzer():
+    from presidio_analyzer import BatchAnalyzerEngine
+
+    return get_resource("Batch Analyzer", lambda: BatchAnalyzerEngine(analyzer_engine=get_analyzer()))
+
+
+def get_anonymizer():
+    from presidio_anonymizer import AnonymizerEngine
+
+    return get_resource("Anonymizer", AnonymizerEngine)
+
+
+def preload_anonymizer():
+    # Loads Presidio in a background thread, so anonymising a conversation when the user leaves the page isn't kept waiting on it
+    if "Anonymizer" not in resources:
+        threading.Thread(target=lambda: (get_batch_analyzer(), get_anonymizer()), daemon=True).start()
+
+
+def get_conversation_table():
+    return get_resource("Conversation Table", lambda: boto_utils.dynamodb_init("conversations"))
+
+
+def get_analysis_queue():
+    return get_resource("Analysis Queue", queue_utils.get_analysis_queue)
+
+
+CLASSIFIER_MODEL_PATH = constants.PATH_MODELS / "MoritzLaurerDeBERTa-v3-large-mnli-fever-anli-ling-wanli"
+# Exported (and int8 quantised) copy of the model for ONNX Runtime, created on first use of the "onnx-int8" backend (gitignored - several GB)
+CLASSIFIER_ONNX_PATH = constants.PATH_MODELS / "MoritzLaurerDeBERTa-v3-large-mnli-fever-anli-ling-wanli-onnx"
+
+# Inference backend for the zero-shot classifier:
+# - "torch": full precision transformers model (default)
+# - "torch-int8": transformers model with torch dynamic int8 quantisation of its linear layers
+# - "onnx-int8": dynamically int8 quantised ONNX export, run with ONNX Runtime (optional - requires onnx & onnxruntime installed)
+CLASSIFIER_BACKENDS = ["torch", "torch-int8", "onnx-int8"]
+CLASSIFIER_BACKEND = os.getenv("CLASSIFIER_BACKEND", "torch")
+
+
+class OnnxClassifierModel:
+    # Runs the ONNX export with ONNX Runtime, returning logits in the same form as the transformers model (so the rest of the code can use either)
+    def __init__(self, model_path, config):
+        import onnxruntime
+
+        self.config = config
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(str(model_path), session_options, providers=["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def __call__(self, **inputs):
+        import torch
+
+        logits = self.session.run(["logits"], {name: inputs[name].numpy() for name in self.input_names})[0]
+
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+
+def export_onnx_classifier(tokenizer):
+    import torch
+    from transformers import AutoModelForSequenceClassification
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    model_path_fp32 = CLASSIFIER_ONNX_PATH / "model.onnx"
+    model_path_int8 = CLASSIFIER_ONNX_PATH / "model-int8.onnx"
+    CLASSIFIER_ONNX_PATH.mkdir(parents=True, exist_ok=True)
+
+    print(f"[Classifier]: Exporting {CLASSIFIER_MODEL_PATH.name} to ONNX")
+    model = AutoModelForSequenceClassification.from_pretrained(CLASSIFIER_MODEL_PATH)
+    example_inputs = dict(tokenizer(["An example message"], [HYPOTHESIS_TEMPLATE.format("an example hypothesis")], return_tensors="pt"))
+    input_names = list(example_inputs.keys())
+
+    torch.onnx.export(
+        model,
+        (example_inputs,),
+        str(model_path_fp32),
+        input_names=input_names,
+        output_names=["logits"],
+        # Batch size & sequence length vary per batch
+        dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in input_names}, "logits": {0: "batch"}},
+        opset_version=17,
+    )
+
+    print("[Classifier]: Quantising ONNX export to int8")
+    quantize_dynamic(str(model_path_fp32), str(model_path_int8), weight_type=QuantType.QInt8)
+
+    return model_path_int8
+
+
 @st.cache_resource
-def load_classifier():
-    from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
-    model_path = constants.PATH_MODELS / "MoritzLaurerDeBERTa-v3-large-mnli-fever-anli-ling-wanli"
+def load_classifier(backend=CLASSIFIER_BACKEND):
+    # Returns an object with the model & tokenizer (a transformers pipeline for the torch backends), as used by batch_zero_shot_classify
+    from transformers import pipeline, AutoConfig, AutoTokenizer, AutoModelForSequenceClassification
+
+    if backend not in CLASSIFIER_BACKENDS:
+        raise ValueError(f"Unknown classifier backend '{backend}', expected one of {CLASSIFIER_BACKENDS}")
 
-    tokenizer = AutoTokenizer.from_pretrained(model_path)
-    model = AutoModelForSequenceClassification.from_pretrained(model_path)
+    tokenizer = AutoTokenizer.from_pretrained(CLASSIFIER_MODEL_PATH)
+
+    if backend == "onnx-int8":
+        model_path_int8 = CLASSIFIER_ONNX_PATH / "model-int8.onnx"
+        if not model_path_int8.exists():
+            model_path_int8 = export_onnx_classifier(tokenizer)
+
+        model = OnnxClassifierModel(model_path_int8, AutoConfig.from_pretrained(CLASSIFIER_MODEL_PATH))
+
+        return SimpleNamespace(model=model, tokenizer=tokenizer)
+
+    model = AutoModelForSequenceClassification.from_pretrained(CLASSIFIER_MODEL_PATH)
+
+    if backend == "torch-int8":
+        import torch
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
 
     return pipeline("zero-shot-classification", model=model, tokenizer=tokenizer, device=-1)
 
 
-def zero_shot_classify(text, classifier, candidate_labels):
-    # Classify specific candidate labels according to the message & specific classifier for specific context
-    result = classifier(text, candidate_labels)
-    label_score_dict = dict(zip(result["labels"], result["scores"]))
-   
-    # Reordering scores according to their candidate label input order (for later correct processing in Lambda)
-    scores_reordered = [label_score_dict[label] for label in candidate_labels]
+# Candidate labels per classification. Score lists are kept in this order (for later correct processing in Lambda)
+ideological_labels = ["Far-left", "Center-left", "Centrist", "Center-right", "Far-right"]
+stance_labels = ["Supportive", "Neutral", "Oppositional"]
+sentiment_labels = ["Positivity", "Neutrality", "Negativity"]
 
-    return scores_reordered
+CLASSIFICATION_LABELS = {
+    "Ideology": [f"This message expresses politically {label} values within UK politics" for label in ideological_labels],
+    "Stance": [f"This message expresses a {label} stance" for label in stance_labels],
+    "Sentiment": [f"This message expresses {label}" for label in sentiment_labels],
+}
 
+# Same hypothesis template as the zero-shot-classification pipeline, so scores match the previous one-message-at-a-time results
+HYPOTHESIS_TEMPLATE = "This example is {}."
+# (message, hypothesis) pairs per forward pass
+CLASSIFIER_BATCH_SIZE = 16
 
-def get_ideology(messages, classifier):
-    ideological_labels = ["Far-left", "Center-left", "Centrist", "Center-right", "Far-right"]
-    ideological_hypotheses_labels = [f"This message expresses politically {label} values within UK politics" for label in ideological_labels]
 
-    message_scores = [zero_shot_classify(message, classifier, candidate_labels=ideological_hypotheses_labels) for message in messages]
+def get_entailment_id(model):
+    for label, label_id in model.config.label2id.items():
+        if label.lower().startswith("entail"):
+            return label_id
 
-    return message_scores
+    return -1
 
 
-def get_stance(messages, classifier):
-    stance_labels = ["Supportive", "Neutral", "Oppositional"]
-    stance_hypotheses_labels = [f"This message expresses a {label} stance" for label in stance_labels]
+def batch_zero_shot_classify(messages, classifier, label_sets, batch_size=CLASSIFIER_BATCH_SIZE):
+    # Classifies every message against every label set in as few forward passes as possible, rather than one pass per message per label.
+    # Returns {label set name: [scores per message, in candidate label order]}
+    import torch
 
-    message_scores = [zero_shot_classify(message, classifier, candidate_labels=stance_hypotheses_labels) for message in messages]
+    if not messages:
+        return {name: [] for name in label_sets}
 
-    return message_scores
+    # One (message, hypothesis) pair per message per candidate label, across all label sets
+    pairs = [
+        (message, HYPOTHESIS_TEMPLATE.format(label))
+        for message in messages
+        for candidate_labels in label_sets.values()
+        for label in candidate_labels
+    ]
 
+    # Pairs of similar length are batched together, so less padding is needed
+    pair_order = sorted(range(len(pairs)), key=lambda pair_index: len(pairs[pair_index][0]) + len(pairs[pair_index][1]))
 
-def get_sentiment(messages, classifier):
-    sentiment_labels = ["Positivity", "Neutrality", "Negativity"]
-    sentiment_hypotheses_labels = [f"This message expresses {label}" for label in sentiment_labels]
+    entailment_id = get_entailment_id(classifier.model)
+    entailment_logits = torch.empty(len(pairs))
+
+    with torch.inference_mode():
+        for batch_start in range(0, len(pair_order), batch_size):
+            batch_indices = pair_order[batch_start:batch_start + batch_size]
+
+            inputs = classifier.tokenizer(
+                [pairs[pair_index][0] for pair_index in batch_indices],
+                [pairs[pair_index][1] for pair_index in batch_indices],
+                padding=True,
+                truncation="only_first",
+                return_tensors="pt",
+            )
+            logits = classifier.model(**inputs).logits
 
-    message_scores = [zero_shot_classify(message, classifier, candidate_labels=sentiment_hypotheses_labels) for message in messages]
-    
-    return message_scores
+            entailment_logits[batch_indices] = logits[:, entailment_id].float()
+
+    # Scatter back per message & label set. As with the pipeline (single label), entailment scores are softmaxed across each set's labels
+    label_set_scores = {name: [] for name in label_sets}
+    pair_index = 0
+
+    for _ in messages:
+        for name, candidate_labels in label_sets.items():
+            message_logits = entailment_logits[pair_index:pair_index + len(candidate_labels)]
+            label_set_scores[name].append(torch.softmax(message_logits, dim=0).tolist())
+            pair_index += len(candidate_labels)
+
+    return label_set_scores
+
+
+def zero_shot_classify(text, classifier, candidate_labels):
+    # Classify specific candidate labels according to the message & specific classifier for specific context
+    return batch_zero_shot_classify([text], classifier, {"Scores": candidate_labels})["Scores"][0]
+
+
+def get_ideology(messages, classifier):
+    return batch_zero_shot_classify(messages, classifier, {"Ideology": CLASSIFICATION_LABELS["Ideology"]})["Ideology"]
+
+
+def get_stance(messages, classifier):
+    return batch_zero_shot_classify(messages, classifier, {"Stance": CLASSIFICATION_LABELS["Stance"]})["Stance"]
+
+
+def get_sentiment(messages, classifier):
+    return batch_zero_shot_classify(messages, classifier, {"Sentiment": CLASSIFICATION_LABELS["Sentiment"]})["Sentiment"]
 
 
 def get_complexity(messages):
+    import textstat
+
     return [textstat.flesch_reading_ease(message) for message in messages]
 
 
-def anonymize_text(text, mp_name):
-    results = analyzer.analyze(text=text, entities=[], language="en")
+# Entity types which are left in place
+ANONYMISE_OMIT_TYPES = {"DATE_TIME", "NRP", "LOCATION", "URL"}
+# Texts per spaCy nlp.pipe batch
+ANONYMISE_BATCH_SIZE = 32
 
-    omit_types = ["DATE_TIME", "NRP", "LOCATION", "URL"]
 
-    filtered_results = []
-    for result in results:
-        if result.entity_type in omit_types:
-            continue
+def anonymize_texts(texts, mp_name):
+    # Anonymises every text in one pass through the spaCy NLP pipeline, rather than one pipeline run per text
+    # References to the MP themselves aren't anonymised
+    mp_name_allowlist = {mp_name, f"{mp_name}'s", f"{mp_name}s", f"{mp_name} MP", f"MP {mp_name}"}
 
-        matched_text = text[result.start:result.end]
-        if result.entity_type == "PERSON" and matched_text in [mp_name, f"{mp_name}'s", f"{mp_name}s", f"{mp_name} MP", f"MP {mp_name}"]:
-            continue
+    texts_results = get_batch_analyzer().analyze_iterator(texts, language="en", batch_size=ANONYMISE_BATCH_SIZE, entities=[])
 
-        filtered_results.append(result)
-    
-    anonymized = anonymizer.anonymize(text=text, analyzer_results=filtered_results)
-    return anonymized.text
+    anonymizer = get_anonymizer()
 
+    anonymized_texts = []
+    for text, results in zip(texts, texts_results):
+        filtered_results = [
+            result for result in results
+            if result.entity_type not in ANONYMISE_OMIT_TYPES
+            and not (result.entity_type == "PERSON" and text[result.start:result.end] in mp_name_allowlist)
+        ]
 
+        anonymized = anonymizer.anonymize(text=text, analyzer_results=filtered_results)
+        anonymized_texts.append(anonymized.text)
 
-def analyse_chat(session_state):
+    return anonymized_texts
+
+
+def anonymize_text(text, mp_name):
+    return anonymize_texts([text], mp_name)[0]
+
+
+def contains_personal_data(text, mp_name):
+    # True if anonymising the text would redact anything, e.g. the user's name, phone number or email address
+    return anonymize_text(text, mp_name) != text
+
+
+
+def get_session_payload(session_state):
+    # Conversation details - everything the analysis worker needs, without any of the (slow) analysis itself
     user_messages = session_state.chat_history.get_author_messages("Human")
 
     # Skip if no messages
     if not user_messages:
+        return None
+
+    ai_messages = session_state.chat_history.get_author_messages("Assistant")
+
+    # Anonymised before the conversation leaves the app, so raw messages are never stored in the queue. User & AI messages
+    # together in one pass
+    messages_anonymised = anonymize_texts([message.content for message in user_messages + ai_messages], session_state.current_mp)
+
+    return {
+        "mp_name": session_state.current_mp,
+        "User Messages": messages_anonymised[:len(user_messages)],
+        "AI Messages": messages_anonymised[len(user_messages):],
+        "Location": session_state.location_codes,
+        "Session Start": str(session_state.session_start),
+        "Session End": str(datetime.now()),
+        "User Competency Scores": {name: session_state.user.get_numerical_score(value) for name, value in session_state.user.competencies.items()},
+    }
+
+
+def analyse_chat(session_state):
+    # Anonymises & queues the conversation for analysis, so the user isn't kept waiting on the classifier. The analysis worker (files/workers/analysis_worker.py) runs analyse_sessions
+    session_payload = get_session_payload(session_state)
+
+    if session_payload is None:
         print("No user messages, skipping analysis")
         return None
-    
-    mp_name = session_state.current_mp
 
-    # 1. Anonymise
-    user_messages_anonymised = [anonymize_text(message.content, mp_name) for message in user_messages]
+    get_analysis_queue().send_message(session_payload)
+    print(f"[{session_payload['mp_name']}]: Conversation queued for analysis")
 
-    ai_messages = session_state.chat_history.get_author_messages("Assistant")
-    ai_messages_anonymised = [anonymize_text(message.content, mp_name) for message in ai_messages]
 
-    # 2. Analyse
-    classifier = load_classifier()
+def classify_sessions(sessions_user_messages, classifier):
+    # Sentiment, stance & ideology for every user message of every session ({index: messages}), classified together in batches.
+    # If that fails, each session is classified separately so only the session at fault fails. Returns ({index: scores}, {index: error})
+    try:
+        all_message_scores = batch_zero_shot_classify([message for user_messages in sessions_user_messages.values() for message in user_messages], classifier, CLASSIFICATION_LABELS)
 
-    user_ward, user_constituency, user_ward_code, user_constituency_code = "Location unavailable", "Location unavailable", "Location unavailable", "Location unavailable"
-    if session_state["location"][0] and session_state["location"][1]:
-        _, user_ward, _, user_constituency, user_ward_code, user_constituency_code = location_utils.get_location_details(session_state["location"][1], session_state["location"][0])
+    except Exception as e:
+        print(f"[Analysis]: Error classifying batch of {len(sessions_user_messages)} conversations, classifying each separately: {e}")
+
+        sessions_scores, session_errors = {}, {}
+        for index, user_messages in sessions_user_messages.items():
+            try:
+                sessions_scores[index] = batch_zero_shot_classify(user_messages, classifier, CLASSIFICATION_LABELS)
+            except Exception as e:
+                session_errors[index] = e
+
+        return sessions_scores, session_errors
+
+    # Each session's share of the batched scores
+    sessions_scores = {}
+    message_start = 0
+    for index, user_messages in sessions_user_messages.items():
+        message_end = message_start + len(user_messages)
+        sessions_scores[index] = {name: scores[message_start:message_end] for name, scores in all_message_scores.items()}
+        message_start = message_end
+
+    return sessions_scores, {}
+
+
+def save_session(session_payload, user_message_scores):
+    session_user_messages, session_ai_messages = session_payload["User Messages"], session_payload["AI Messages"]
+    session_start = datetime.fromisoformat(session_payload["Session Start"])
+    session_end = datetime.fromisoformat(session_payload["Session End"])
+
+    websearch_messages_anonymised = [message for message in session_ai_messages if "WEB SEARCH:" in message]
+    sensitive_messages_anonymised = [message for message in session_ai_messages if "SENSITIVE REPLY: " in message]
 
-    websearch_messages_anonymised = [message for message in ai_messages_anonymised if "WEB SEARCH:" in message]
-    sensitive_messages_anonymised = [message for message in ai_messages_anonymised if "SENSITIVE REPLY: " in message]
-    
     chat_info = {
         # Partition key
-        "mp_name": mp_name,
+        "mp_name": session_payload["mp_name"],
 
         # plus a extra sort-key for unique Primary Key (partition + sort key)
-        "conversation_datetime": str(datetime.now()),
+        "conversation_datetime": session_payload["Session End"],
 
 
-        "Session Date": str(session_state.session_start.date()),
-        "Session Start Time": session_state.session_start.strftime("%H:%M:%S"),
-        "Session Length": str(datetime.now() - session_state.session_start),
+        "Session Date": str(session_start.date()),
+        "Session Start Time": session_start.strftime("%H:%M:%S"),
+        "Session Length": str(session_end - session_start),
 
         # User Location - MAY NOT BE THE SAME AS MP
-        "Ward": user_ward,
-        "Ward Code": user_ward_code,
-        "Constituency": user_constituency,
-        "Constituency Code": user_constituency_code,
+        # Resolved by the app (see location_utils.get_location_codes), so the user's coordinates are never queued
+        "Ward": session_payload["Location"]["Ward"],
+        "Ward Code": session_payload["Location"]["Ward Code"],
+        "Constituency": session_payload["Location"]["Constituency"],
+        "Constituency Code": session_payload["Location"]["Constituency Code"],
 
         # Have to store these as topic modelling cannot be done per-message-set on-the-fly.
-        "User Messages": user_messages_anonymised,
-        "Number of User Messages": len(user_messages_anonymised),
-        "User Message Lengths": [len(message) for message in user_messages_anonymised],
+        "User Messages": session_user_messages,
+        "Number of User Messages": len(session_user_messages),
+        "User Message Lengths": [len(message) for message in session_user_messages],
 
-        "Number of AI Messages": len(ai_messages_anonymised),
-        "AI FRE Scores": get_complexity(ai_messages_anonymised),
+        "Number of AI Messages": len(session_ai_messages),
+        "AI FRE Scores": get_complexity(session_ai_messages),
 
         "AI Websearch Messages": websearch_messages_anonymised,
         "Number of AI Websearches": len(websearch_messages_anonymised),
         "Number of Sensitive Messages": len(sensitive_messages_anonymised),
 
-        "User FRE Scores": get_complexity(user_messages_anonymised),
-        "User Sentiment Scores": get_sentiment(user_messages_anonymised, classifier),
-        "User Stance Scores": get_stance(user_messages_anonymised, classifier),
-        "User Ideology Scores": get_ideology(user_messages_anonymised, classifier),
+        "User FRE Scores": get_complexity(session_user_messages),
+        "User Sentiment Scores": user_message_scores["Sentiment"],
+        "User Stance Scores": user_message_scores["Stance"],
+        "User Ideology Scores": user_message_scores["Ideology"],
 
-        "User Competency Scores": {name: session_state.user.get_numerical_score(value) for name, value in session_state.user.competencies.items()},
+        "User Competency Scores": session_payload["User Competency Scores"],
 
     }
 
     # Convert all inputs to str temporarily as DynamoDB will not accept floats. In Lambda will pull in and re-characterise var types manually
     chat_info_str = {key: str(value) for key, value in chat_info.items()}
 
-    # 3. Send back for saving to db
-    boto_utils.dynamodb_upload_record(conversation_table, chat_info_str)
\ No newline at end of file
+    boto_utils.dynamodb_upload_record(get_conversation_table(), chat_info_str)
+
+
+def analyse_sessions(session_payloads):
+    # Analyses a batch of queued conversations and saves each to the db. User messages from every session are classified together.
+    # A failing session doesn't stop the rest of the batch being saved - returns {index: error} for the sessions which failed.
+    # Messages were anonymised before being queued (see get_session_payload)
+    # 1. Analyse
+    sessions_scores, session_errors = classify_sessions({index: session_payload["User Messages"] for index, session_payload in enumerate(session_payloads)}, load_classifier())
+
+    # 2. Send back for saving to db
+    for index, user_message_scores in sessions_scores.items():
+        try:
+            save_session(session_payloads[index], user_message_scores)
+        except Exception as e:
+            session_errors[index] = e
+
+    return session_errors
@@ -2,9 +2,12 @@ import boto3
 import botocore
 from boto3.dynamodb.conditions import Key
 from zoneinfo import ZoneInfo
+import threading
 
 import utils.constants as constants
 
+thread_local = threading.local()
+
 
 def dynamodb_init(table_name):
     dynamodb = boto3.resource(
@@ -19,6 +22,17 @@ def dynamodb_init(table_name):
     return table
 
 
+def dynamodb_init_per_thread(table_name):
+    # boto3 resources aren't thread-safe, so each calling thread gets (and re-uses) its own table object
+    if not hasattr(thread_local, "tables"):
+        thread_local.tables = {}
+
+    if table_name not in thread_local.tables:
+        thread_local.tables[table_name] = dynamodb_init(table_name)
+
+    return thread_local.tables[table_name]
+
+
 def dynamodb_upload_record(table, data):
     try:
         # NOTE: The partition key value from the table needs to be present in the data dict being passed
@@ -29,6 +43,21 @@ def dynamodb_upload_record(table, data):
         print(f"[{table}]: Error uploading data: {e}")
 
 
+def dynamodb_update_record(table, partition_key, partition_key_value, data):
+    # Unlike dynamodb_upload_record, only the attributes in data are set - any others already on the item are kept
+    try:
+        response = table.update_item(
+            Key={partition_key: partition_key_value},
+            UpdateExpression="SET " + ", ".join(f"#attr{i} = :value{i}" for i in range(len(data))),
+            ExpressionAttributeNames={f"#attr{i}": key for i, key in enumerate(data)},
+            ExpressionAttributeValues={f":value{i}": value for i, value in enumerate(data.values())},
+        )
+        print(f"[{table}]: Item successfully updated: {response}")
+
+    except Exception as e:
+        print(f"[{table}]: Error updating data: {e}")
+
+
 def dynamodb_fetch_record(table, partition_key, partition_key_value):
     try:
         response = table.get_item(Key={partition_key: partition_key_value})
@@ -103,4 +132,15 @@ def s3_batch_get_all_files():
         
         all_files.append({"filename": key, "content": content, "modified": response["LastModified"].astimezone(ZoneInfo("Europe/London"))})
 
-    return all_files
\ No newline at end of file
+    return all_files
+
+
+def sqs_init():
+    sqs = boto3.client(
+        "sqs",
+        region_name=constants.AWS_REGION,
+        aws_access_key_id=constants.TOKEN_AWS_ACCESS,
+        aws_secret_access_key=constants.TOKEN_AWS_SECRET,
+    )
+
+    return sqs
@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from contextlib import closing
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import utils.boto_utils as boto_utils
+
+# Query embedding cache - in-process LRU, plus an optional on-disk cache (only used if a path is set)
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+QUERY_EMBEDDING_CACHE_PATH = os.getenv("QUERY_EMBEDDING_CACHE_PATH")
+
+# Semantic answer cache - near-duplicate first questions about the same MP (for users of the same competency) reuse a stored final answer
+ANSWER_CACHE_SIMILARITY_THRESHOLD = 0.95
+ANSWER_CACHE_MAX_ENTRIES_PER_MP = 500
+# Upper bound on an answer's age, even if no new data has been ingested for the MP
+ANSWER_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+# How long an MP's data version (written by the ingestion Lambdas to mp-daily-update-records) is trusted before re-checking
+DATA_VERSION_CHECK_SECONDS = 5 * 60
+
+
+def get_mp_data_version(mp_name):
+    # Changes whenever the ingestion Lambdas upsert new data for the MP, invalidating any answers cached before it
+    mp_update_record = boto_utils.dynamodb_fetch_record(boto_utils.dynamodb_init_per_thread("mp-daily-update-records"), "mp_name", mp_name) or {}
+
+    return mp_update_record.get("Data Version", "None")
+
+
+class SemanticAnswerCache:
+    def __init__(self, similarity_threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD, max_entries_per_mp=ANSWER_CACHE_MAX_ENTRIES_PER_MP, ttl_seconds=ANSWER_CACHE_TTL_SECONDS):
+        self.similarity_threshold = similarity_threshold
+        self.max_entries_per_mp = max_entries_per_mp
+        self.ttl_seconds = ttl_seconds
+
+        # Shared by every session in the app process
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.data_versions = {}
+        self.stats = {}
+
+    def _check_data_version(self, mp_name):
+        # Drops the MP's cached answers if new data has been ingested since they were stored
+        checked_version = self.data_versions.get(mp_name)
+
+        if checked_version and time.monotonic() - checked_version["checked"] < DATA_VERSION_CHECK_SECONDS:
+            return
+
+        data_version = get_mp_data_version(mp_name)
+
+        with self.lock:
+            if checked_version and checked_version["version"] != data_version:
+                print(f"[{mp_name}]: New data ingested ({data_version}), clearing {len(self.entries.get(mp_name, []))} cached answers")
+                self.entries.pop(mp_name, None)
+
+            self.data_versions[mp_name] = {"version": data_version, "checked": time.monotonic()}
+
+    def _record(self, mp_name, outcome):
+        mp_stats = self.stats.setdefault(mp_name, {"Hits": 0, "Misses": 0})
+        mp_stats[outcome] += 1
+
+    def get(self, mp_name, question_embedding, user_competency):
+        self._check_data_version(mp_name)
+        question_embedding = np.asarray(question_embedding, dtype=np.float32)
+
+        with self.lock:
+            now = time.monotonic()
+            self.entries[mp_name] = [entry for entry in self.entries.get(mp_name, []) if now - entry["time"] < self.ttl_seconds]
+            candidates = [entry for entry in self.entries[mp_name] if entry["user_competency"] == user_competency]
+
+            if candidates:
+                # OpenAI embeddings are unit length, so the dot product is the cosine similarity
+                similarities = np.stack([entry["embedding"] for entry in candidates]) @ question_embedding
+                best_index = int(np.argmax(similarities))
+
+                if similarities[best_index] >= self.similarity_threshold:
+                    self._record(mp_name, "Hits")
+                    print(f"[{mp_name}]: Answer cache hit (similarity {similarities[best_index]:.3f}) - {self.get_hit_rate(mp_name):.0%} hit rate")
+                    return candidates[best_index]["answer"]
+
+            self._record(mp_name, "Misses")
+            return None
+
+    def add(self, mp_name, question_embedding, user_competency, answer):
+        with self.lock:
+            mp_entries = self.entries.setdefault(mp_name, [])
+            mp_entries.append({
+                "embedding": np.asarray(question_embedding, dtype=np.float32),
+                "user_competency": user_competency,
+                "answer": answer,
+                "time": time.monotonic(),
+            })
+
+            # Oldest answers are dropped first
+            if len(mp_entries) > self.max_entries_per_mp:
+                del mp_entries[:len(mp_entries) - self.max_entries_per_mp]
+
+    def get_hit_rate(self, mp_name=None):
+        mp_stats = [self.stats[mp_name]] if mp_name else list(self.stats.values())
+        hits = sum(stats["Hits"] for stats in mp_stats if stats)
+        lookups = hits + sum(stats["Misses"] for stats in mp_stats if stats)
+
+        return hits / lookups if lookups else 0
+
+    def get_stats(self):
+        with self.lock:
+            return {mp_name: {**mp_stats, "Cached Answers": len(self.entries.get(mp_name, []))} for mp_name, mp_stats in self.stats.items()}
+
+
+answer_cache = SemanticAnswerCache()
+
+
+def normalise_query(text):
+    # Questions differing only in case or spacing share an embedding
+    return " ".join(text.split()).casefold()
+
+
+class CachedQueryEmbeddings(Embeddings):
+    # Drop-in wrapper for an Embeddings object (e.g. OpenAIEmbeddings) which caches embed_query results.
+    # Document embeddings are passed straight through, as they're only created by ingestion
+    def __init__(self, embeddings, max_size=QUERY_EMBEDDING_CACHE_SIZE, cache_path=QUERY_EMBEDDING_CACHE_PATH):
+        self.embeddings = embeddings
+        self.max_size = max_size
+        self.cache_path = cache_path
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.stats = {"Hits": 0, "Disk Hits": 0, "Misses": 0}
+
+        if self.cache_path:
+            with closing(sqlite3.connect(self.cache_path)) as connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS query_embeddings (model TEXT NOT NULL, query TEXT NOT NULL, embedding BLOB NOT NULL, PRIMARY KEY (model, query))")
+                connection.commit()
+
+    def _get_cached(self, query):
+        with self.lock:
+            if query in self.cache:
+                self.cache.move_to_end(query)
+                self.stats["Hits"] += 1
+                return self.cache[query]
+
+        if self.cache_path:
+            with closing(sqlite3.connect(self.cache_path, timeout=30)) as connection:
+                row = connection.execute("SELECT embedding FROM query_embeddings WHERE model = ? AND query = ?", (self.model, query)).fetchone()
+
+            if row:
+                embedding = array("f")
+                embedding.frombytes(row[0])
+                embedding = embedding.tolist()
+                self._add_cached(query, embedding, persist=False)
+
+                with self.lock:
+                    self.stats["Disk Hits"] += 1
+
+                return embedding
+
+        with self.lock:
+            self.stats["Misses"] += 1
+
+        return None
+
+    def _add_cached(self, query, embedding, persist=True):
+        with self.lock:
+            self.cache[query] = embedding
+            self.cache.move_to_end(query)
+
+            # Least recently used are dropped first
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+        if persist and self.cache_path:
+            with closing(sqlite3.connect(self.cache_path, timeout=30)) as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (model, query, embedding) VALUES (?, ?, ?)",
+                    (self.model, query, array("f", embedding).tobytes()),
+                )
+                connection.commit()
+
+    def embed_query(self, text):
+        query = normalise_query(text)
+        embedding = self._get_cached(query)
+
+        if embedding is None:
+            embedding = self.embeddings.embed_query(text)
+            self._add_cached(query, embedding)
+
+        return embedding
+
+    async def aembed_query(self, text):
+        query = normalise_query(text)
+        embedding = self._get_cached(query)
+
+        if embedding is None:
+            embedding = await self.embeddings.aembed_query(text)
+            self._add_cached(query, embedding)
+
+        return embedding
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts):
+        return await self.embeddings.aembed_documents(texts)
@@ -0,0 +1,905 @@
+# Shared helpers for the ingestion Lambdas (lambda_get_all_data_monthly / lambda_get_data_daily)
+import asyncio
+import hashlib
+import itertools
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import datetime
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+import httpx
+import tiktoken
+
+import utils.boto_utils as boto_utils
+
+# Limits applied per host, shared by every MP worker thread (members-api, hansard-api, etc. are rate limited independently)
+MAX_CONCURRENT_REQUESTS_PER_HOST = int(os.getenv("PARLIAMENT_API_MAX_CONCURRENCY", 5))
+MAX_REQUESTS_PER_SECOND_PER_HOST = float(os.getenv("PARLIAMENT_API_REQUESTS_PER_SECOND", 10))
+REQUEST_TIMEOUT = 30
+
+# Retry behaviour for rate limiting (429) and transient server errors (5xx)
+MAX_RETRIES = 4
+RETRY_BACKOFF_SECONDS = 0.5
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Shared HTTP session - connections are kept alive and reused across requests (and across warm Lambda invocations)
+HTTP_MAX_CONNECTIONS = int(os.getenv("PARLIAMENT_API_MAX_CONNECTIONS", 20))
+HTTP_HEADERS = {"Accept": "application/json", "Accept-Encoding": "gzip"}
+
+# On-disk response cache for conditional GETs (If-None-Match / If-Modified-Since), so unchanged resources come back as 304s
+HTTP_CACHE_PATH = os.getenv("HTTP_CACHE_PATH", "/tmp/civic-sage-http-cache.sqlite3")
+# Least recently used responses are evicted past this size (see sqlite_cache_evict)
+HTTP_CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_MB", 100)) * 1024 ** 2
+# Caches are evicted down to this fraction of their max size, so eviction isn't re-run on every write
+CACHE_EVICTION_TARGET = 0.8
+
+# OpenAI embeddings endpoint limits (text-embedding-3-small)
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_ENCODING = "cl100k_base"
+EMBEDDING_MAX_INPUTS_PER_REQUEST = 2048
+EMBEDDING_MAX_TOKENS_PER_REQUEST = 300000
+
+# Persistent embedding cache, keyed by the md5 content hash used as each record's Pinecone id (Lambda can only write to /tmp)
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "/tmp/civic-sage-embedding-cache.sqlite3")
+# Least recently used embeddings are evicted past this size, so the cache can't fill /tmp (512MB by default) on a full-House run
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_MB", 200)) * 1024 ** 2
+SQLITE_MAX_VARIABLES = 900
+# Records are embedded (and cache-checked) this many at a time, bounding how many texts/vectors are held in memory
+EMBEDDING_WINDOW_RECORDS = 500
+
+# How each parliament_api section is turned into records - one record for the whole section, or one per item
+data_processing_types = {
+    "Group": ["Biography", "Synopsis", "General Details", "Contact Details", "Latest Election Details", "Registered Interests"],
+    "Separate": ["Spoken Contributions", "Submitted Written Questions", "Supported Early Day Motions", "Voting"],
+}
+
+# Pinecone upserts (per-request limits are 1000 records / 2MB, kept under with some headroom)
+UPSERT_MAX_BATCH_RECORDS = 100
+UPSERT_MAX_BATCH_BYTES = 1_800_000
+UPSERT_WORKERS = int(os.getenv("UPSERT_WORKERS", 4))
+# Producers block once this many batches are waiting/in flight, bounding memory if Pinecone is slower than embedding
+UPSERT_MAX_PENDING_BATCHES = UPSERT_WORKERS * 2
+
+# Multi-MP orchestration
+MEMBERS_SEARCH_URL = "https://members-api.parliament.uk/api/Members/Search?House=1&IsCurrentMember=true&take={take}&skip={skip}"
+MEMBERS_SEARCH_PAGE_SIZE = 20
+MP_WORKERS = int(os.getenv("INGESTION_MP_WORKERS", 4))
+# Stop starting new MPs once less than this much Lambda time remains (they're picked up by the next invocation)
+LAMBDA_TIME_MARGIN_MS = int(os.getenv("INGESTION_TIME_MARGIN_MS", 120000))
+
+
+class IngestionError(Exception):
+    # Raised when an MP's data can't be fully fetched or stored, so run_mp_ingestion records the MP as failed (and it's retried)
+    pass
+
+
+class TokenBucket:
+    # Smooths requests out to a steady rate, replacing the fixed time.sleep() gaps between pages
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def sqlite_cache_init(path, table, columns):
+    # Creates a cache table with a last_used column for eviction (added to any cache created before it had one)
+    with closing(sqlite3.connect(path)) as connection:
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns}, last_used REAL NOT NULL DEFAULT 0)")
+
+        if "last_used" not in {column[1] for column in connection.execute(f"PRAGMA table_info({table})")}:
+            connection.execute(f"ALTER TABLE {table} ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+
+        connection.commit()
+
+
+def sqlite_cache_evict(connection, table, max_bytes):
+    # Deletes the least recently used rows once the cache's used pages pass max_bytes (freed pages are reused, so the file stops growing)
+    page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+    used_pages = connection.execute("PRAGMA page_count").fetchone()[0] - connection.execute("PRAGMA freelist_count").fetchone()[0]
+    used_bytes = used_pages * page_size
+
+    if used_bytes <= max_bytes:
+        return
+
+    row_count = connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    evict_count = math.ceil(row_count * (1 - max_bytes * CACHE_EVICTION_TARGET / used_bytes))
+    connection.execute(f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} ORDER BY last_used LIMIT ?)", (evict_count,))
+    print(f"[Cache]: Evicted {evict_count} of {row_count} {table} ({used_bytes / 1024 ** 2:.0f}MB used, {max_bytes / 1024 ** 2:.0f}MB max)")
+
+
+def http_cache_init(path=HTTP_CACHE_PATH):
+    # Returns the cache path - connections are opened per call, as with the embedding cache
+    sqlite_cache_init(path, "responses", "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, body TEXT NOT NULL")
+
+    return path
+
+
+def http_cache_fetch_record(cache_path, url):
+    # A cache that can't be read is treated as a miss - the request is just made without conditional headers
+    try:
+        with closing(sqlite3.connect(cache_path, timeout=30)) as connection:
+            row = connection.execute("SELECT etag, last_modified, body FROM responses WHERE url = ?", (url,)).fetchone()
+
+    except sqlite3.Error as e:
+        print(f"[Cache]: HTTP cache unavailable, treating as a miss: {e}")
+        return None
+
+    return {"etag": row[0], "last_modified": row[1], "body": row[2]} if row else None
+
+
+def http_cache_touch_record(cache_path, url):
+    # Marks a response served from the cache (a 304) as recently used, so it's the last to be evicted
+    try:
+        with closing(sqlite3.connect(cache_path, timeout=30)) as connection:
+            connection.execute("UPDATE responses SET last_used = ? WHERE url = ?", (time.time(), url))
+            connection.commit()
+
+    except sqlite3.Error as e:
+        print(f"[Cache]: Failed to write to the HTTP cache, skipping: {e}")
+
+
+def http_cache_upload_record(cache_path, url, etag, last_modified, body, max_bytes=HTTP_CACHE_MAX_BYTES):
+    # Skipped if the write fails - the response is still used, and just isn't conditional next time
+    try:
+        with closing(sqlite3.connect(cache_path, timeout=30)) as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (url, etag, last_modified, body, last_used) VALUES (?, ?, ?, ?, ?)",
+                (url, etag, last_modified, body, time.time()),
+            )
+            sqlite_cache_evict(connection, "responses", max_bytes)
+            connection.commit()
+
+    except sqlite3.Error as e:
+        print(f"[Cache]: Failed to write to the HTTP cache, skipping: {e}")
+
+
+def get_conditional_headers(cached_response):
+    headers = {}
+
+    if cached_response:
+        if cached_response["etag"]:
+            headers["If-None-Match"] = cached_response["etag"]
+
+        if cached_response["last_modified"]:
+            headers["If-Modified-Since"] = cached_response["last_modified"]
+
+    return headers
+
+
+def get_endpoint_key(url):
+    # Group stats by endpoint rather than by resource, e.g. /api/Members/4803/Biography -> /api/Members/{id}/Biography
+    parts = urlsplit(url)
+    return parts.netloc + re.sub(r"/\d+(?=/|$)", "/{id}", parts.path)
+
+
+class HttpStats:
+    # Per-endpoint counts of 304 hits (served from the response cache), full 200 responses and failures
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, url, outcome):
+        with self.lock:
+            endpoint_stats = self.endpoints.setdefault(get_endpoint_key(url), {"Hits": 0, "Misses": 0, "Errors": 0})
+            endpoint_stats[outcome] += 1
+
+    def summary(self):
+        with self.lock:
+            return {endpoint: dict(endpoint_stats) for endpoint, endpoint_stats in self.endpoints.items()}
+
+    def print_summary(self):
+        for endpoint, endpoint_stats in sorted(self.summary().items()):
+            requests_made = sum(endpoint_stats.values())
+            hit_rate = endpoint_stats["Hits"] / requests_made if requests_made else 0
+            print(f"[HTTP]: {endpoint} - {endpoint_stats['Hits']} hits / {endpoint_stats['Misses']} misses / {endpoint_stats['Errors']} errors ({hit_rate:.0%} not modified)")
+
+
+http_stats = HttpStats()
+
+
+def handle_response(url, response, cached_response, cache_path):
+    # Returns the decoded JSON body - from the cache on a 304, or from the response (caching it if it's cacheable) on a 200
+    if response.status_code == 304 and cached_response:
+        http_stats.record(url, "Hits")
+        http_cache_touch_record(cache_path, url)
+        return json.loads(cached_response["body"])
+
+    http_stats.record(url, "Misses")
+
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if etag or last_modified:
+        http_cache_upload_record(cache_path, url, etag, last_modified, response.text)
+
+    return response.json()
+
+
+@lru_cache
+def get_http_client():
+    # A single pooled client for synchronous requests (httpx.Client is thread safe, so MP worker threads share it)
+    return httpx.Client(
+        timeout=REQUEST_TIMEOUT,
+        follow_redirects=True,
+        headers=HTTP_HEADERS,
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+    )
+
+
+def get_json(url, cache_path=HTTP_CACHE_PATH):
+    # Synchronous conditional GET through the shared session (used for one-off requests, e.g. send_api_request)
+    cached_response = http_cache_fetch_record(cache_path, url)
+
+    try:
+        response = get_http_client().get(url, headers=get_conditional_headers(cached_response))
+
+    except httpx.TransportError as e:
+        http_stats.record(url, "Errors")
+        print(f"{url}\nError: {e}\n\n---------------")
+        return None
+
+    if response.status_code in (200, 304):
+        return handle_response(url, response, cached_response, cache_path)
+
+    http_stats.record(url, "Errors")
+    print(f"{url}\nError: {response.status_code}\n\n---------------")
+    return None
+
+
+# One event loop (in a background thread) runs every fetch in the process. MP worker threads submit to it through run_with_fetcher,
+# so they share one set of per-host limits rather than each multiplying them
+fetcher_loop = None
+fetcher_loop_lock = threading.Lock()
+# Per-host (semaphore, TokenBucket), and the AsyncFetcher whose pooled client is kept for the whole ingestion run (closed by
+# close_fetcher) - only used from the fetcher loop's thread
+host_limits = {}
+shared_fetcher = None
+
+
+def get_fetcher_loop():
+    global fetcher_loop
+
+    with fetcher_loop_lock:
+        if fetcher_loop is None:
+            fetcher_loop = asyncio.new_event_loop()
+            threading.Thread(target=fetcher_loop.run_forever, name="ingestion-fetcher-loop", daemon=True).start()
+
+    return fetcher_loop
+
+
+def get_host_limits(url):
+    host = urlsplit(url).netloc
+
+    if host not in host_limits:
+        host_limits[host] = (asyncio.Semaphore(MAX_CONCURRENT_REQUESTS_PER_HOST), TokenBucket(MAX_REQUESTS_PER_SECOND_PER_HOST))
+
+    return host_limits[host]
+
+
+class AsyncFetcher:
+    # NOTE: Must only be used on the fetcher loop (its client & the host limits are bound to it), so use run_with_fetcher() from sync code
+    def __init__(self, cache_path=HTTP_CACHE_PATH):
+        self.cache_path = cache_path
+        self.client = httpx.AsyncClient(
+            timeout=REQUEST_TIMEOUT,
+            follow_redirects=True,
+            headers=HTTP_HEADERS,
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.client.aclose()
+
+    async def get_json(self, url):
+        semaphore, rate_limiter = get_host_limits(url)
+        cached_response = http_cache_fetch_record(self.cache_path, url)
+
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                async with semaphore:
+                    await rate_limiter.acquire()
+                    response = await self.client.get(url, headers=get_conditional_headers(cached_response))
+
+            except httpx.TransportError as e:
+                if attempt == MAX_RETRIES:
+                    http_stats.record(url, "Errors")
+                    print(f"{url}\nError: {e}\n\n---------------")
+                    return None
+
+                await asyncio.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt)
+                continue
+
+            if response.status_code in (200, 304):
+                return handle_response(url, response, cached_response, self.cache_path)
+
+            if response.status_code in RETRY_STATUS_CODES and attempt < MAX_RETRIES:
+                # Exponential backoff, unless the API tells us how long to wait
+                retry_after = response.headers.get("Retry-After")
+                await asyncio.sleep(float(retry_after) if retry_after and retry_after.isdigit() else RETRY_BACKOFF_SECONDS * 2 ** attempt)
+                continue
+
+            http_stats.record(url, "Errors")
+            print(f"{url}\nError: {response.status_code}\n\n---------------")
+            return None
+
+    async def fetch_all_json(self, urls):
+        # Results are returned in the same order as urls (None for any request which failed)
+        return await asyncio.gather(*[self.get_json(url) for url in urls])
+
+    async def fetch_all_pages(self, api_url, first_page=None):
+        # api_url is expected to end in "?" or "&" so that "page=N" can be appended (as in parliament_api paths)
+        # "complete" is False if any page failed, in which case "items" is missing those pages' records
+        if first_page is None:
+            first_page = await self.get_json(f"{api_url}page=1")
+
+        if not first_page:
+            return {"items": [], "totalResults": 0, "complete": False}
+
+        if not first_page.get("items"):
+            return {"items": [], "totalResults": first_page.get("totalResults", 0), "complete": True}
+
+        # Discover how many pages exist from the first page, then fetch the rest concurrently
+        total_results = first_page.get("totalResults", len(first_page["items"]))
+        page_size = first_page.get("take") or len(first_page["items"])
+        total_pages = math.ceil(total_results / page_size)
+
+        remaining_pages = await asyncio.gather(*[self.get_json(f"{api_url}page={page}") for page in range(2, total_pages + 1)])
+
+        # Merge back into the same {"items": [...]} structure the store_* functions expect (pages kept in order)
+        merged_data = {"items": list(first_page["items"]), "totalResults": total_results, "complete": all(remaining_pages)}
+        for page_data in remaining_pages:
+            if page_data:
+                merged_data["items"].extend(page_data["items"])
+
+        return merged_data
+
+    async def fetch_pages_until(self, api_url, is_already_stored, first_page=None, page_window=MAX_CONCURRENT_REQUESTS_PER_HOST):
+        # Delta sync - collects items (newest first) until is_already_stored(item) is true, then stops paging.
+        # Later pages are fetched in concurrent windows that start at one page and double up to page_window, so a daily run
+        # with a handful of new records only requests the pages it needs.
+        # "complete" is False if a page failed before the watermark was reached, so the caller shouldn't advance its watermark
+        if first_page is None:
+            first_page = await self.get_json(f"{api_url}page=1")
+
+        if not first_page:
+            return {"items": [], "pagesFetched": 0, "complete": False}
+
+        total_results = first_page.get("totalResults", len(first_page["items"]))
+        page_size = first_page.get("take") or len(first_page["items"]) or 1
+        total_pages = math.ceil(total_results / page_size)
+
+        new_items = []
+        pages = [first_page]
+        next_page = 2
+        pages_fetched = 1
+        window_size = 1
+
+        while True:
+            for page_data in pages:
+                if not page_data:
+                    return {"items": new_items, "pagesFetched": pages_fetched, "complete": False}
+
+                for item in page_data["items"]:
+                    if is_already_stored(item):
+                        return {"items": new_items, "pagesFetched": pages_fetched, "complete": True}
+
+                    new_items.append(item)
+
+            if next_page > total_pages:
+                return {"items": new_items, "pagesFetched": pages_fetched, "complete": True}
+
+            window_end = min(next_page + window_size, total_pages + 1)
+            pages = await asyncio.gather(*[self.get_json(f"{api_url}page={page}") for page in range(next_page, window_end)])
+            pages_fetched += window_end - next_page
+            next_page = window_end
+            window_size = min(window_size * 2, page_window)
+
+    async def fetch_current_mps(self):
+        # The Members search endpoint pages with skip/take rather than page=N
+        first_page = await self.get_json(MEMBERS_SEARCH_URL.format(take=MEMBERS_SEARCH_PAGE_SIZE, skip=0))
+
+        if not first_page:
+            return []
+
+        remaining_pages = await asyncio.gather(*[
+            self.get_json(MEMBERS_SEARCH_URL.format(take=MEMBERS_SEARCH_PAGE_SIZE, skip=skip))
+            for skip in range(MEMBERS_SEARCH_PAGE_SIZE, first_page["totalResults"], MEMBERS_SEARCH_PAGE_SIZE)
+        ])
+
+        return [
+            {"Name": member["value"]["nameDisplayAs"], "ID": member["value"]["id"]}
+            for page_data in [first_page, *remaining_pages] if page_data
+            for member in page_data["items"]
+        ]
+
+
+async def _run_with_fetcher(task):
+    # Keep-alive connections carry over between endpoints, detail batches and MPs
+    global shared_fetcher
+
+    if shared_fetcher is None:
+        shared_fetcher = AsyncFetcher()
+
+    return await task(shared_fetcher)
+
+
+async def _close_fetcher():
+    global shared_fetcher
+
+    if shared_fetcher is not None:
+        await shared_fetcher.client.aclose()
+        shared_fetcher = None
+
+
+def run_with_fetcher(task):
+    # Run an async task (taking an AsyncFetcher) to completion from synchronous Lambda code (blocks the calling thread, not the loop)
+    return asyncio.run_coroutine_threadsafe(_run_with_fetcher(task), get_fetcher_loop()).result()
+
+
+def close_fetcher():
+    # Closes the shared client once the run has finished (a new one is opened by the next run in a warm Lambda container)
+    if fetcher_loop is not None:
+        asyncio.run_coroutine_threadsafe(_close_fetcher(), fetcher_loop).result()
+
+
+def fetch_all_pages(api_url, first_page=None):
+    return run_with_fetcher(lambda fetcher: fetcher.fetch_all_pages(api_url, first_page))
+
+
+def fetch_pages_until(api_url, is_already_stored, first_page=None):
+    return run_with_fetcher(lambda fetcher: fetcher.fetch_pages_until(api_url, is_already_stored, first_page))
+
+
+def fetch_all_json(urls):
+    return run_with_fetcher(lambda fetcher: fetcher.fetch_all_json(urls))
+
+
+def get_current_mps():
+    # Same {"Name", "ID"} shape as the manual mp_list in each Lambda, but for every sitting MP
+    return run_with_fetcher(lambda fetcher: fetcher.fetch_current_mps())
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    return tiktoken.get_encoding(EMBEDDING_ENCODING)
+
+
+def batch_texts_for_embedding(texts, max_inputs=EMBEDDING_MAX_INPUTS_PER_REQUEST, max_tokens=EMBEDDING_MAX_TOKENS_PER_REQUEST):
+    # Group texts (in order) into the largest batches a single embeddings request will accept
+    tokenizer = get_tokenizer()
+
+    batch = []
+    batch_tokens = 0
+
+    for text in texts:
+        text_tokens = len(tokenizer.encode(text))
+
+        if batch and (len(batch) >= max_inputs or batch_tokens + text_tokens > max_tokens):
+            yield batch
+            batch = []
+            batch_tokens = 0
+
+        batch.append(text)
+        batch_tokens += text_tokens
+
+    if batch:
+        yield batch
+
+
+def split_text(text, max_length=1000, overlap=0, length_unit="characters"):
+    # Splits on whitespace into chunks no longer than max_length, measured in "characters" or embedding "tokens".
+    # overlap carries up to that many trailing characters/tokens of each chunk into the next.
+    # The running chunk length is tracked incrementally (rather than re-joining the chunk for every word) so this is linear in len(text).
+    words = text.split()
+
+    if length_unit == "tokens":
+        # Tokens of " word", so joining spaces are already counted (a close approximation of encoding the joined chunk)
+        word_lengths = [len(tokens) for tokens in get_tokenizer().encode_ordinary_batch([f" {word}" for word in words])]
+        separator_length = 0
+    else:
+        word_lengths = [len(word) for word in words]
+        separator_length = 1
+
+    chunks = []
+    chunk_start = 0
+    chunk_length = 0
+
+    for i, word_length in enumerate(word_lengths):
+        if i > chunk_start and chunk_length + separator_length + word_length > max_length:
+            chunks.append(" ".join(words[chunk_start:i]))
+
+            # Start the next chunk with as many trailing words as fit in the overlap (and still leave room for this word)
+            next_chunk_start = i
+            next_chunk_length = 0
+
+            while next_chunk_start - 1 > chunk_start:
+                extended_length = next_chunk_length + word_lengths[next_chunk_start - 1] + (separator_length if next_chunk_length else 0)
+
+                if extended_length > overlap or extended_length + separator_length + word_length > max_length:
+                    break
+
+                next_chunk_start -= 1
+                next_chunk_length = extended_length
+
+            chunk_start = next_chunk_start
+            chunk_length = next_chunk_length
+
+        chunk_length += word_length + (separator_length if i > chunk_start else 0)
+
+    if chunk_start < len(words):
+        chunks.append(" ".join(words[chunk_start:]))
+
+    return chunks
+
+
+def embedding_cache_init(path=EMBEDDING_CACHE_PATH):
+    # Returns the cache path - connections are opened per call so the cache can be shared by ingestion worker threads
+    sqlite_cache_init(path, "embeddings", "id TEXT PRIMARY KEY, embedding BLOB NOT NULL")
+
+    return path
+
+
+def embedding_cache_fetch_records(cache_path, ids):
+    # A cache that can't be read (e.g. /tmp is full or the file is corrupt) is treated as a miss, so the texts are just re-embedded
+    cached_embeddings = {}
+    ids = list(ids)
+
+    try:
+        with closing(sqlite3.connect(cache_path, timeout=30)) as connection:
+            # Query in chunks to stay under SQLite's limit on bound variables
+            for i in range(0, len(ids), SQLITE_MAX_VARIABLES):
+                chunk = ids[i:i + SQLITE_MAX_VARIABLES]
+                rows = connection.execute(f"SELECT id, embedding FROM embeddings WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+
+                for id, embedding_bytes in rows:
+                    embedding = array("f")
+                    embedding.frombytes(embedding_bytes)
+                    cached_embeddings[id] = embedding.tolist()
+
+            # Hits are marked as recently used, so they're the last to be evicted
+            connection.executemany("UPDATE embeddings SET last_used = ? WHERE id = ?", [(time.time(), id) for id in cached_embeddings])
+            connection.commit()
+
+    except sqlite3.Error as e:
+        print(f"[Cache]: Embedding cache unavailable, treating as a miss: {e}")
+
+    return cached_embeddings
+
+
+def embedding_cache_upload_records(cache_path, embeddings_by_id, max_bytes=EMBEDDING_CACHE_MAX_BYTES):
+    # Stored as float32 bytes, the same precision Pinecone keeps. Skipped (with the embeddings still used) if the write fails
+    try:
+        with closing(sqlite3.connect(cache_path, timeout=30)) as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (id, embedding, last_used) VALUES (?, ?, ?)",
+                [(id, array("f", embedding).tobytes(), time.time()) for id, embedding in embeddings_by_id.items()],
+            )
+            sqlite_cache_evict(connection, "embeddings", max_bytes)
+            connection.commit()
+
+    except sqlite3.Error as e:
+        print(f"[Cache]: Failed to write to the embedding cache, skipping: {e}")
+
+
+def get_embeddings(client_openai, texts, model=EMBEDDING_MODEL):
+    # Embed many texts in as few requests as possible (batched within the model's per-request limits)
+    # Yields each request's embeddings (in input order) as soon as it returns, so they can be upserted while the next batch is embedded
+    for batch in batch_texts_for_embedding(texts):
+        response = client_openai.embeddings.create(
+            model=model,
+            input=batch,
+        )
+
+        yield [item.embedding for item in sorted(response.data, key=lambda item: item.index)], response.usage.total_tokens
+
+
+def split_long_strings(obj, max_length=1000):
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            if isinstance(value, str) and len(value) > max_length:
+                obj[key] = split_text(value, max_length)
+
+            else:
+                split_long_strings(value, max_length)
+
+    elif isinstance(obj, list):
+        for item in obj:
+            split_long_strings(item, max_length)
+
+    return obj
+
+
+def clean_value_types(data):
+    if isinstance(data, dict):
+        return {key: clean_value_types(value) for key, value in data.items()}
+    
+    elif isinstance(data, list):
+        return [clean_value_types(item) for item in data]
+    
+    elif isinstance(data, bool):
+        return "Yes" if data else "No"
+    
+    elif data is None:
+        return ""
+    
+    elif isinstance(data, int) or isinstance(data, float):
+        return str(data)
+    
+    else:
+        return data
+
+
+def transform_to_text(data):
+    result = []
+    
+    if not isinstance(data, str):
+        for section, content in data.items():
+
+            if isinstance(content, dict):
+                section_text = f"{section}:\n"
+
+                for key, value in content.items():
+                    if isinstance(value, dict):
+                        section_text += f"  {key}:\n"
+                        for sub_key, sub_value in value.items():
+                            section_text += f"    {sub_key}: {sub_value}\n"
+
+                    else:
+                        section_text += f"  {key}: {value}\n"
+            else:
+                section_text = f"{section}: {content}\n"
+            
+            result.append(section_text)
+        
+        return "\n".join(result)
+    
+    else:
+        return data
+
+
+def prepare_data_for_upsert(metadata, source):
+    text_data = transform_to_text(metadata)
+    id = hashlib.md5(text_data.encode()).hexdigest()
+
+    # Embedding is deferred so records can be embedded together in batches (see embed_records)
+    return (id, text_data, {"text": text_data, "data_source": source})
+
+
+def embed_records(pending_records, mp_name, client_openai, index, embedding_cache, diff_mode=True):
+    # pending_records can be a generator - records are pulled, de-duplicated, cache-checked and embedded one bounded window at a time
+    # Same text means same id, so duplicates are dropped (as is anything already stored in the Pinecone index when in diff mode)
+    existing_ids = get_existing_ids(index, mp_name) if diff_mode else set()
+    seen_ids = set()
+
+    tokens_used = 0
+    records_embedded = 0
+    records_cached = 0
+
+    for records_window in itertools.batched(pending_records, EMBEDDING_WINDOW_RECORDS):
+        new_records = []
+        for record in records_window:
+            if record[0] not in existing_ids and record[0] not in seen_ids:
+                seen_ids.add(record[0])
+                new_records.append(record)
+
+        # Only embed records that aren't already in the local embedding cache - cached ones are yielded straight away
+        cached_embeddings_by_id = embedding_cache_fetch_records(embedding_cache, [id for id, _, _ in new_records])
+        records_to_embed = [record for record in new_records if record[0] not in cached_embeddings_by_id]
+        records_cached += len(cached_embeddings_by_id)
+
+        for id, _, metadata in new_records:
+            if id in cached_embeddings_by_id:
+                yield (id, cached_embeddings_by_id[id], metadata)
+
+        batch_start = 0
+        for embeddings, batch_tokens_used in get_embeddings(client_openai, [text_data for _, text_data, _ in records_to_embed]):
+            batch_records = records_to_embed[batch_start:batch_start + len(embeddings)]
+            batch_start += len(embeddings)
+            tokens_used += batch_tokens_used
+
+            embedding_cache_upload_records(embedding_cache, {id: embedding for (id, _, _), embedding in zip(batch_records, embeddings)})
+
+            for (id, _, metadata), embedding in zip(batch_records, embeddings):
+                yield (id, embedding, metadata)
+
+        records_embedded += len(records_to_embed)
+
+    print(f"[{mp_name}]: Embedded {records_embedded} records ({tokens_used} tokens), {records_cached} from cache")
+
+
+def iter_mp_records(mp_id, mp_data, apis):
+    # Yields one (id, text, metadata) record at a time, for each of the Lambda's parliament_api "apis" present in mp_data.
+    # Each record is cleaned and chunked on its own as it's reached, rather than deep-copying (and then re-walking) the whole MP tree up front
+    for data_section, api_data_dict in apis.items():
+        if data_section not in mp_data["Parliament"]:
+            continue
+
+        source = api_data_dict["source"].replace("{id}", str(mp_id))
+        metadata = mp_data["Parliament"][data_section]
+
+        if data_section in data_processing_types["Separate"]:
+            # Individual
+            for key, value in metadata.items():
+                if isinstance(value, dict):
+                    # Change every entry of bool 'false' / 'true' to str "No" / "Yes"
+                    value_cleaned = split_long_strings(clean_value_types(value), max_length=1000)
+                    metadata_individual_record = {key: value_cleaned, "subject": f"Individual record of {data_section} ({key})"}
+                    yield prepare_data_for_upsert(metadata_individual_record, source)
+
+        elif data_section in data_processing_types["Group"]:
+            yield prepare_data_for_upsert(split_long_strings(clean_value_types(metadata), max_length=1000), source)
+
+
+class StreamingUpserter:
+    # Accepts records one at a time as they are embedded and upserts them in size-aware batches on a thread pool
+    def __init__(self, index, namespace, workers=UPSERT_WORKERS, max_batch_records=UPSERT_MAX_BATCH_RECORDS, max_batch_bytes=UPSERT_MAX_BATCH_BYTES, max_pending_batches=UPSERT_MAX_PENDING_BATCHES):
+        self.index = index
+        self.namespace = namespace
+        self.max_batch_records = max_batch_records
+        self.max_batch_bytes = max_batch_bytes
+
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pending_batch_slots = threading.BoundedSemaphore(max_pending_batches)
+        self.futures = []
+
+        self.batch = []
+        self.batch_bytes = 0
+
+        self.start_time = time.monotonic()
+        self.stats = {"Records Upserted": 0, "Records Failed": 0, "Batches": 0}
+        self.stats_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def add(self, record):
+        # record is an (id, embedding, metadata) tuple, sized as it will be sent (JSON)
+        record_bytes = len(json.dumps(record))
+
+        if self.batch and (len(self.batch) >= self.max_batch_records or self.batch_bytes + record_bytes > self.max_batch_bytes):
+            self._submit_batch()
+
+        self.batch.append(record)
+        self.batch_bytes += record_bytes
+
+    def _submit_batch(self):
+        batch = self.batch
+        self.batch = []
+        self.batch_bytes = 0
+
+        # Backpressure - wait for a free slot before queueing more work
+        self.pending_batch_slots.acquire()
+        future = self.executor.submit(self._upsert_batch, batch)
+        future.add_done_callback(lambda _: self.pending_batch_slots.release())
+        self.futures.append(future)
+
+    def _upsert_batch(self, batch):
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                self.index.upsert(batch, namespace=self.namespace)
+
+                with self.stats_lock:
+                    self.stats["Records Upserted"] += len(batch)
+                    self.stats["Batches"] += 1
+                return
+
+            except Exception as e:
+                if attempt == MAX_RETRIES:
+                    print(f"[{self.namespace}]: Error upserting batch of {len(batch)} records: {e}")
+
+                    with self.stats_lock:
+                        self.stats["Records Failed"] += len(batch)
+                    return
+
+                time.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt)
+
+    def close(self):
+        # Raises if any batch still failed after retrying, so callers stop before recording the records as stored
+        if self.batch:
+            self._submit_batch()
+
+        self.executor.shutdown(wait=True)
+
+        elapsed = time.monotonic() - self.start_time
+        self.stats["Records Per Second"] = round(self.stats["Records Upserted"] / elapsed, 1) if elapsed else 0.0
+        print(f"[{self.namespace}]: Upsert complete - {self.stats}")
+
+        if self.stats["Records Failed"]:
+            raise IngestionError(f"[{self.namespace}]: {self.stats['Records Failed']} records failed to upsert")
+
+        return self.stats
+
+
+def get_existing_ids(index, namespace):
+    # Every record id already upserted into the MP's namespace (ids are content hashes, so unchanged records keep the same id)
+    existing_ids = set()
+
+    for ids_page in index.list(namespace=namespace):
+        existing_ids.update(ids_page)
+
+    return existing_ids
+
+
+def get_shard(mps, shard_index=0, shard_count=1):
+    # Interleaved so every shard gets a similar mix of MPs
+    return mps[shard_index::shard_count]
+
+
+def run_mp_ingestion(collect_mp_function, mps, run_type, run_id, checkpoint_table_name, lambda_context=None, max_workers=MP_WORKERS):
+    # Runs collect_mp_function for each MP across a thread pool, checkpointing each completed MP so a timed-out run can resume.
+    # collect_mp_function returns the MP's upsert stats (or None if there was nothing to store), and should raise if the MP's data
+    # couldn't be fully fetched or stored
+    checkpoint_field = f"Last Completed {run_type} Run"
+
+    def ingest_mp(member_dict):
+        checkpoint_table = boto_utils.dynamodb_init_per_thread(checkpoint_table_name)
+        mp_checkpoint = boto_utils.dynamodb_fetch_record(checkpoint_table, "mp_name", member_dict["Name"]) or {}
+
+        if mp_checkpoint.get(checkpoint_field) == run_id:
+            print(f"[{member_dict['Name']}]: Already completed in {run_id}, skipping")
+            return "Skipped"
+
+        if lambda_context and lambda_context.get_remaining_time_in_millis() < LAMBDA_TIME_MARGIN_MS:
+            print(f"[{member_dict['Name']}]: Not enough time left in this invocation, deferring to next run")
+            return "Deferred"
+
+        try:
+            store_stats = collect_mp_function(member_dict)
+
+        except Exception as e:
+            print(f"[{member_dict['Name']}]: Error during ingestion: {e}")
+            return "Failed"
+
+        # Only checkpointed once every record is confirmed stored - a partially stored MP isn't skipped by a resumed run, so is retried
+        if store_stats and store_stats.get("Records Failed"):
+            print(f"[{member_dict['Name']}]: {store_stats['Records Failed']} records failed to store, will retry")
+            return "Failed"
+
+        boto_utils.dynamodb_update_record(checkpoint_table, "mp_name", member_dict["Name"], {checkpoint_field: run_id, f"{checkpoint_field} Time": str(datetime.now())})
+        return "Completed"
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            outcomes = list(executor.map(ingest_mp, mps))
+
+    finally:
+        close_fetcher()
+
+    ingestion_summary = {outcome: [] for outcome in ["Completed", "Skipped", "Deferred", "Failed"]}
+    for member_dict, outcome in zip(mps, outcomes):
+        ingestion_summary[outcome].append(member_dict["Name"])
+
+    print(f"[{run_id}]: " + ", ".join(f"{outcome}: {len(names)}" for outcome, names in ingestion_summary.items()))
+    # Counts are kept for the life of the (possibly warm) Lambda container
+    http_stats.print_summary()
+
+    return ingestion_summary
@@ -40,6 +40,17 @@ def get_location_details(longitude, latitude):
         print(f"Error getting location: {e}")
 
 
+def get_location_codes(latitude, longitude):
+    # Ward & constituency (names and codes) for a location, each "Location unavailable" if it can't be found
+    location_details = get_location_details(longitude, latitude) if latitude and longitude else None
+
+    if not location_details or location_details[0] != "Success":
+        return {"Ward": "Location unavailable", "Ward Code": "Location unavailable", "Constituency": "Location unavailable", "Constituency Code": "Location unavailable"}
+
+    _, admin_ward, _, constituency, admin_ward_code, constituency_code = location_details
+    return {"Ward": admin_ward, "Ward Code": admin_ward_code, "Constituency": constituency, "Constituency Code": constituency_code}
+
+
 def get_mp_by_constituency(session_state):
     if not session_state["location"][0] or not session_state["location"][1]:
         return "Location unavailable", None, None, None, None
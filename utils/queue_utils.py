@@ -0,0 +1,129 @@
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+from contextlib import closing
+
+import utils.boto_utils as boto_utils
+
+# Conversation analysis queue - an SQS queue if its URL is set, otherwise a durable local SQLite queue
+ANALYSIS_QUEUE_URL = os.getenv("ANALYSIS_QUEUE_URL")
+# Kept outside the repo. Messages are anonymised before they're queued (see analysis_utils.get_session_payload)
+ANALYSIS_QUEUE_PATH = os.getenv("ANALYSIS_QUEUE_PATH", os.path.join(tempfile.gettempdir(), "civic-sage-analysis-queue.sqlite3"))
+# Conversations which fail analysis are dead-lettered - moved to this SQS queue if set (otherwise left for the SQS queue's own
+# redrive policy), or to the SQLite queue's dead_letters table
+ANALYSIS_DEAD_LETTER_QUEUE_URL = os.getenv("ANALYSIS_DEAD_LETTER_QUEUE_URL")
+
+# Received messages are hidden from other workers for this long, then re-delivered unless deleted (so a crashed worker's messages aren't lost)
+VISIBILITY_TIMEOUT_SECONDS = 10 * 60
+# Messages which have been received this many times without being deleted or dead-lettered (e.g. the worker crashed) are no
+# longer delivered (left in the queue for inspection)
+MAX_RECEIVE_COUNT = 5
+# SQS limit for a single receive / delete call
+SQS_MAX_MESSAGES = 10
+
+
+class SQLiteQueue:
+    def __init__(self, path=ANALYSIS_QUEUE_PATH):
+        self.path = path
+
+        with closing(self._connect()) as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS messages (message_id TEXT PRIMARY KEY, body TEXT NOT NULL, visible_at REAL NOT NULL, receive_count INTEGER NOT NULL DEFAULT 0)")
+            connection.execute("CREATE TABLE IF NOT EXISTS dead_letters (message_id TEXT PRIMARY KEY, body TEXT NOT NULL, error TEXT NOT NULL, failed_at REAL NOT NULL)")
+            connection.commit()
+
+    def _connect(self):
+        # The app and worker are separate processes, so wait on (rather than fail from) each other's locks
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def send_message(self, payload):
+        with closing(self._connect()) as connection:
+            connection.execute("INSERT INTO messages (message_id, body, visible_at) VALUES (?, ?, ?)", (str(uuid.uuid4()), json.dumps(payload), time.time()))
+
+    def receive_messages(self, max_messages=SQS_MAX_MESSAGES, visibility_timeout=VISIBILITY_TIMEOUT_SECONDS):
+        # Returns [(message_id, payload)], oldest first
+        with closing(self._connect()) as connection:
+            # Claimed in one write transaction, so two workers never receive the same message
+            connection.execute("BEGIN IMMEDIATE")
+            rows = connection.execute(
+                "SELECT message_id, body FROM messages WHERE visible_at <= ? AND receive_count < ? ORDER BY rowid LIMIT ?",
+                (time.time(), MAX_RECEIVE_COUNT, max_messages),
+            ).fetchall()
+
+            connection.executemany(
+                "UPDATE messages SET visible_at = ?, receive_count = receive_count + 1 WHERE message_id = ?",
+                [(time.time() + visibility_timeout, message_id) for message_id, _ in rows],
+            )
+            connection.execute("COMMIT")
+
+        return [(message_id, json.loads(body)) for message_id, body in rows]
+
+    def delete_messages(self, message_ids):
+        with closing(self._connect()) as connection:
+            connection.executemany("DELETE FROM messages WHERE message_id = ?", [(message_id,) for message_id in message_ids])
+
+    def dead_letter_messages(self, failed_messages):
+        # Takes [(message_id, payload, error)]. Moved out of the queue in one transaction, kept (with the error) for inspection
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany(
+                "INSERT OR REPLACE INTO dead_letters (message_id, body, error, failed_at) VALUES (?, ?, ?, ?)",
+                [(message_id, json.dumps(payload), error, time.time()) for message_id, payload, error in failed_messages],
+            )
+            connection.executemany("DELETE FROM messages WHERE message_id = ?", [(message_id,) for message_id, _, _ in failed_messages])
+            connection.execute("COMMIT")
+
+
+class SQSQueue:
+    # Same interface as SQLiteQueue. Visibility timeout & max receives (redrive policy) are configured on the SQS queue itself
+    def __init__(self, queue_url=ANALYSIS_QUEUE_URL, dead_letter_queue_url=ANALYSIS_DEAD_LETTER_QUEUE_URL):
+        self.queue_url = queue_url
+        self.dead_letter_queue_url = dead_letter_queue_url
+        self.sqs = boto_utils.sqs_init()
+
+    def send_message(self, payload):
+        self.sqs.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(payload))
+
+    def receive_messages(self, max_messages=SQS_MAX_MESSAGES, visibility_timeout=VISIBILITY_TIMEOUT_SECONDS):
+        messages = []
+
+        while len(messages) < max_messages:
+            response = self.sqs.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=min(SQS_MAX_MESSAGES, max_messages - len(messages)),
+                VisibilityTimeout=visibility_timeout,
+            )
+
+            if not response.get("Messages"):
+                break
+
+            messages.extend((message["ReceiptHandle"], json.loads(message["Body"])) for message in response["Messages"])
+
+        return messages
+
+    def delete_messages(self, message_ids):
+        for batch_start in range(0, len(message_ids), SQS_MAX_MESSAGES):
+            self.sqs.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{"Id": str(index), "ReceiptHandle": receipt_handle} for index, receipt_handle in enumerate(message_ids[batch_start:batch_start + SQS_MAX_MESSAGES])],
+            )
+
+    def dead_letter_messages(self, failed_messages):
+        # Without a dead-letter queue URL, failed messages are re-delivered until the queue's redrive policy moves them
+        if not self.dead_letter_queue_url:
+            return
+
+        for _, payload, error in failed_messages:
+            self.sqs.send_message(
+                QueueUrl=self.dead_letter_queue_url,
+                MessageBody=json.dumps(payload),
+                MessageAttributes={"Error": {"DataType": "String", "StringValue": error}},
+            )
+
+        self.delete_messages([message_id for message_id, _, _ in failed_messages])
+
+
+def get_analysis_queue():
+    return SQSQueue(ANALYSIS_QUEUE_URL, ANALYSIS_DEAD_LETTER_QUEUE_URL) if ANALYSIS_QUEUE_URL else SQLiteQueue(ANALYSIS_QUEUE_PATH)
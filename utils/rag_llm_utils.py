@@ -7,10 +7,16 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_pinecone import PineconeVectorStore
 from langchain_core.runnables import RunnablePassthrough
 from pinecone import Pinecone, ServerlessSpec
-from functools import partial
+from functools import lru_cache
 from datetime import datetime
+import asyncio
+import threading
+import time
 
 import utils.constants as constants
+import utils.cache_utils as cache_utils
+import utils.boto_utils as boto_utils
+import utils.analysis_utils as analysis_utils
 
 index_name = "mp-records"
 pc = Pinecone(api_key=constants.TOKEN_PINECONE)
@@ -27,7 +33,24 @@ if index_name not in pc.list_indexes().names():
 
 dense_index = pc.Index(index_name)
 
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small", api_key=constants.TOKEN_OPENAI)
+# "two-pass" rewrites every successful answer with the political-debiasing prompt. "fused" puts the impartiality rules in the
+# answer prompt itself, and only rewrites answers which fail a local check (see needs_debias)
+ANSWER_MODES = ["two-pass", "fused"]
+ANSWER_MODE = "two-pass"
+
+# Near-duplicate first questions about an MP are answered from the semantic answer cache (see cache_utils).
+# Off by default so tests & evaluation always exercise the full chain - the app opts in per call
+USE_ANSWER_CACHE = False
+
+# Number of MPs whose vector store, retriever and chain are kept built in memory (least recently used are dropped first)
+MP_CHAIN_CACHE_SIZE = 32
+
+# Contact context per MP, shared by every session in the app process (see get_mp_contact_context)
+contact_context_cache = {}
+contact_context_lock = threading.Lock()
+
+# Query embeddings are cached (by normalised text), so repeated and constant queries (e.g. "MP contact details") aren't re-embedded
+embeddings = cache_utils.CachedQueryEmbeddings(OpenAIEmbeddings(model="text-embedding-3-small", api_key=constants.TOKEN_OPENAI))
 
 llm = ChatOpenAI(
     model="gpt-4o-mini",
@@ -40,17 +63,26 @@ llm = ChatOpenAI(
 
 llm_with_tools = llm.bind_tools([{"type": "web_search_preview"}])
 
+# Chat history is only summarised once this many messages have built up since the last summary, until then they're included raw.
+# Only messages still in the ChatHistory's message_window (its last size messages) are used, so size bounds what reaches the LLM
+HISTORY_INLINE_MESSAGES = 6
+# When summarising, the most recent messages are still kept raw alongside the summary
+HISTORY_RAW_MESSAGES = 2
+
 prompt_template_summarise_history = SystemMessagePromptTemplate.from_template(
-    "Your job is to take in a list of chat messages that make up the chat history of you and the user. Summarise the discussion as if you need to remember the key points."
+    "Your job is to keep a running summary of the chat history of you and the user. Update the current summary with the new chat messages, summarising the discussion as if you need to remember the key points."
 )
 
 summarise_template = ChatPromptTemplate.from_messages(
     [
         prompt_template_summarise_history,
-        ("human", "{user_input}")
+        ("human", "Current summary: {summary}"),
+        ("human", "New chat messages: {user_input}"),
     ]
 )
 
+chain_summarise_history = summarise_template | llm
+
 
 class ChatHistory:
     def __init__(self, size: int):
@@ -59,6 +91,13 @@ class ChatHistory:
         self.all_messages = []
         self.current_message_index = 0
 
+        # Running summary of every message up to (and including) summarised_message_index
+        self.summary = ""
+        self.summarised_message_index = 0
+
+        # Seconds taken by each timed branch of the last question's chain (see timed())
+        self.timings = {}
+
     def add_message(self, message: str):
         if len(self.message_window) >= self.size:
             self.message_window.pop(0)
@@ -89,6 +128,13 @@ class ChatHistory:
 
     def get_message_window_formatted(self, _=None):
         return {"user_input": self._format_messages(self.message_window)}
+
+    def get_unsummarised_messages(self):
+        return [message for message in self.message_window if message["message_index"] > self.summarised_message_index]
+
+    def update_summary(self, summary, summarised_message_index):
+        self.summary = summary
+        self.summarised_message_index = summarised_message_index
     
     # Get a list of all the raw messages from a specific author (either user or AI/assistant)
     def get_author_messages(self, author):
@@ -133,7 +179,8 @@ class User:
         return competencies_str
 
 
-# Temporary set-up of chat history & vector store which is then replaced when module initialised with session-based chat history.
+# Default chat history, used when a session's ChatHistory isn't passed in explicitly (e.g. single-session scripts and tests).
+# Sessions sharing a process should each pass their own ChatHistory (session_history) rather than relying on init()
 chat_history = ChatHistory(size=20)
 def init(ch):
     global chat_history
@@ -142,7 +189,9 @@ def init(ch):
     return chat_history
 
 
-chain_summarise_history = chat_history.get_message_window_formatted | summarise_template | llm
+def get_session_history(session_history=None):
+    return session_history if session_history is not None else chat_history
+
 
 
 prompt_template = ChatPromptTemplate.from_messages(
@@ -188,17 +237,86 @@ prompt_template = ChatPromptTemplate.from_messages(
     ]
 )
 
+# Same as prompt_template, with the political-debiasing rules added so the first answer can usually be used as-is
+prompt_template_fused = ChatPromptTemplate.from_messages(
+    [
+        prompt_template.messages[0],
+        SystemMessage(
+            content="""
+            - Present information impartially, as an unbiased person. You do not discriminate or frame answers on the basis of political belief, gender, race, religion, or any other sensitive attribute.
+
+            - If the question is potentially contentious, explicitly reference multiple viewpoints or major party perspectives, and include source URLs for verification.
+            """
+        ),
+        *prompt_template.messages[1:],
+    ]
+)
+
+# Used by needs_debias - an answer touching on these without any of the viewpoint terms is rewritten
+CONTENTIOUS_TERMS = ["vote", "voted", "bill", "policy", "policies", "oppose", "criticis", "controvers", "debate"]
+VIEWPOINT_TERMS = ["however", "on the other hand", "critics", "supporters", "opponents", "others argue", "some argue", "viewpoint", "perspective"]
+
+
+def get_messages_to_summarise(session_history):
+    # Only messages added since the last summary are looked at, so the cost per question stays flat as the conversation grows
+    unsummarised_messages = session_history.get_unsummarised_messages()
+
+    # Short enough to include as-is, no LLM call needed. Otherwise fold all but the most recent messages into the running summary
+    # (for a small window, once it's full, before its oldest unsummarised message drops out)
+    if len(unsummarised_messages) > min(HISTORY_INLINE_MESSAGES, session_history.size - 1):
+        return unsummarised_messages[:-HISTORY_RAW_MESSAGES]
+
+    return []
+
+
+def format_history(session_history):
+    recent_messages = session_history._format_messages(session_history.get_unsummarised_messages())
+
+    if session_history.summary:
+        return f"{session_history.summary}\n\nMost recent messages:{recent_messages}"
+
+    return recent_messages
+
 
 def summarize_history(input_):
-    # First, summarize the chat history
-    summary_chain = chat_history.get_message_window_formatted | summarise_template | llm
-    history_summary = summary_chain.invoke(None)
-    
-    return {
-        "history": history_summary.content,
-        "question": input_["question"],
-        "user_competency": input_["user_competency"],
-    }
+    session_history = input_["session_history"]
+    messages_to_summarise = get_messages_to_summarise(session_history)
+
+    if messages_to_summarise:
+        history_summary = chain_summarise_history.invoke({"summary": session_history.summary or "None", "user_input": session_history._format_messages(messages_to_summarise)})
+        session_history.update_summary(history_summary.content, messages_to_summarise[-1]["message_index"])
+
+    return format_history(session_history)
+
+
+async def asummarize_history(input_):
+    session_history = input_["session_history"]
+    messages_to_summarise = get_messages_to_summarise(session_history)
+
+    if messages_to_summarise:
+        history_summary = await chain_summarise_history.ainvoke({"summary": session_history.summary or "None", "user_input": session_history._format_messages(messages_to_summarise)})
+        session_history.update_summary(history_summary.content, messages_to_summarise[-1]["message_index"])
+
+    return format_history(session_history)
+
+
+def timed(branch_name, runnable):
+    # Wraps a chain branch so its run time is recorded on the session's chat history (for both invoke and ainvoke)
+    def run_timed(input_, config):
+        start_time = time.perf_counter()
+        output = runnable.invoke(input_, config)
+        input_["session_history"].timings[branch_name] = time.perf_counter() - start_time
+
+        return output
+
+    async def arun_timed(input_, config):
+        start_time = time.perf_counter()
+        output = await runnable.ainvoke(input_, config)
+        input_["session_history"].timings[branch_name] = time.perf_counter() - start_time
+
+        return output
+
+    return RunnableLambda(run_timed, afunc=arun_timed)
 
 
 def format_docs(docs):
@@ -206,123 +324,222 @@ def format_docs(docs):
     return docs_done
 
 
-def check_and_search(result, retriever, mp_name, mp_constituency, date, user):
-    # If result is an AIMessage, extract its content and the original question
-    if hasattr(result, "content"):
-        # If results are too personal, re-direct.
-        if result.content.strip() == "PERSONAL":
+def get_mp_contact_context(mp_name):
+    # Built by the monthly ingestion Lambda into the MP's summaries record, in the same format as format_docs.
+    # Cached per MP against its Data Version (re-checked every DATA_VERSION_CHECK_SECONDS), so re-ingested details are picked up
+    with contact_context_lock:
+        cached_context = contact_context_cache.get(mp_name)
 
-            prompt_template_redirect_contact = ChatPromptTemplate.from_messages(
-                [SystemMessage(
-                    content="""
-                        You've received a response which is overly sensitive or personal outside of the scope of your objectives. Your job is to re-direct the user to the appropriate contact services or their MP (only if its within their responsibilities) based on the context and original message provided below.
-                        """
-                    ),
-                    ("human", "Context: {context}"),
-                    ("human", "Original message: {message}"),
-                ]
-            )
+    if cached_context and time.monotonic() - cached_context["checked"] < cache_utils.DATA_VERSION_CHECK_SECONDS:
+        return cached_context["context"]
 
-            chain_redirect_contact = RunnablePassthrough.assign(
-                context=RunnableLambda(lambda x: x["question"]) | retriever | format_docs 
-            ) | prompt_template_redirect_contact | llm
+    data_version = cache_utils.get_mp_data_version(mp_name)
 
-            sensitive_reply = chain_redirect_contact.invoke({"question": "MP contact details", "message": chat_history.get_last_message()["message"].content})
+    if cached_context and cached_context["version"] == data_version:
+        with contact_context_lock:
+            cached_context["checked"] = time.monotonic()
 
-            return f"SENSITIVE REPLY: \n___\n{sensitive_reply.content}"
-        
-        # If no relevant results found, conduct a websearch
-        elif result.content.strip() == "UNKNOWN":
-            # Try to get the original question from the additional context
-            question = chat_history.get_last_message()["message"].content
-            if question:
-                try:
-                    prompt_template_search = ChatPromptTemplate.from_messages(
-                        [SystemMessage(
-                            content="""
-                            Your name is Civic Sage. You are designed to helpfully answer questions about UK politics, government and parliament. Your current focus is on the current-day Member of Parliament (MP) mentioned below.
-
-                            Examine the original question below. If you can answer it, do so. If not, perform a web search to find the best results and explain the findings.
-
-                            RULES:
-                            - ALWAYS provide URL sources if possible, included after the relevant statement on the same text line, formatted as "[SOURCE URL: URL HERE].
-
-                            - Keep your explanation brief, no more than 2 paragraphs worth of text.
-
-                            - For complex or reasoning questions, explain your reasoning step by step before giving the final answer, for example:
-                                User: Why did the MP vote against the bill?
-                                AI: To answer, I'll check the MP's voting record, public statements, and any debate contributions. The MP voted against the bill [SOURCE URL:...]. In the debate, she expressed concerns about funding allocations [SOURCE URL:...]. Her official statement cited local constituent feedback as a factor [SOURCE URL:...]. Therefore, the MP's reasons appear to be funding concerns and constituent input.
-                                
-                            """
-                            ),
-                            ("human", "Todays date: {date}"),
-                            ("human", "MP name: {mp_name}"),
-                            ("human", "MP constituency: {mp_constituency}"),
-                            ("human", "User self-described expertise: {user_competency}"),
-                            ("human", "Original question: {question}"),
-                            
-                        ]
-                    )
-
-                    chain_web_search = prompt_template_search | llm_with_tools
-                    search_results = chain_web_search.invoke({"question": question, "mp_name": mp_name, "mp_constituency": mp_constituency, "date": date, "user_competency": user.get_competencies_plaintext()})
-
-                    # Check if the LLM actually performed a web search or just answered it by-itself and classify accordingly 
-                    # (some responses are UNKNOWN) but don't require a web search
-                    if search_results.additional_kwargs.get("tool_outputs"):
-                        return f"WEB SEARCH: Unfortunately I couldn't generate an answer based on my internal data. Instead, here's what I found from searching the internet:\n___\n{search_results.content[0]['text']}"
-                    else:
-                        return search_results.content[0]["text"]
-
-                except Exception as e:
-                    return f"Error performing web search: {str(e)}"
-            else:
-                return "Unable to perform web search: No question found."
-        
-        # If not PERSONAL/UNKNOWN, question was successful, now run additional political-debiasing prompt
-        # Try to get the original question from the additional context
-        question = chat_history.get_last_message()["message"].content
-        if question:
-            prompt_template_political_bias = ChatPromptTemplate.from_messages(
-                [SystemMessage(
-                    content="""
-                    Your name is Civic Sage. You are designed to helpfully answer questions about UK politics, government and parliament. Your current focus is on the current-day Member of Parliament (MP) labelled below.
-
-                    Labelled below is an original text you generated.
-
-                    Now rephrase your original text as needed, considering that you are an unbiased person whose priority is to present information impartially. 
-                    If the question is potentially contentious, explicitly reference multiple viewpoints or major party perspectives, and include source URLs for verification. 
-                    You do not discriminate or frame answers on the basis of political belief, gender, race, religion, or any other sensitive attribute.
-                    
-                    ALWAYS provide URL sources if possible, included after the relevant statement on the same text line, formatted as "[SOURCE URL: URL HERE].              
-
-                    The original question is also labelled below.
-                    """
-                    ),
-                    ("human", "Todays date: {date}"),
-                    ("human", "MP name: {mp_name}"),
-                    ("human", "Original text generated: {original_response}"),
-                    ("human", "Original question: {question}"),
-                ]
-            )
-
-            chain_political_debias = prompt_template_political_bias | llm
-            results = chain_political_debias.invoke({"question": question, "original_response": result.content, "mp_name": mp_name, "date": date})
+        return cached_context["context"]
+
+    mp_summary_data = boto_utils.dynamodb_fetch_record(boto_utils.dynamodb_init("summaries"), "mp_name", mp_name) or {}
+    contact_context = mp_summary_data.get("Contact Context")
+
+    with contact_context_lock:
+        # Misses aren't cached, so an MP's context is used as soon as the ingestion Lambda first writes it
+        if contact_context is None:
+            contact_context_cache.pop(mp_name, None)
+        else:
+            contact_context_cache[mp_name] = {"version": data_version, "context": contact_context, "checked": time.monotonic()}
+
+    return contact_context
+
+
+def needs_debias(response):
+    # Cheap local check used in "fused" mode, in place of always running the political-debiasing rewrite
+    response_lower = response.casefold()
+
+    # Answers should always cite their sources
+    if "[source url:" not in response_lower:
+        return True
+
+    # Potentially contentious answers should reference more than one viewpoint
+    if any(term in response_lower for term in CONTENTIOUS_TERMS) and not any(term in response_lower for term in VIEWPOINT_TERMS):
+        return True
+
+    return False
+
+
+prompt_template_redirect_contact = ChatPromptTemplate.from_messages(
+    [SystemMessage(
+        content="""
+            You've received a response which is overly sensitive or personal outside of the scope of your objectives. Your job is to re-direct the user to the appropriate contact services or their MP (only if its within their responsibilities) based on the context and original message provided below.
+            """
+        ),
+        ("human", "Context: {context}"),
+        ("human", "Original message: {message}"),
+    ]
+)
+
+chain_redirect_contact = prompt_template_redirect_contact | llm
+
+
+prompt_template_search = ChatPromptTemplate.from_messages(
+    [SystemMessage(
+        content="""
+        Your name is Civic Sage. You are designed to helpfully answer questions about UK politics, government and parliament. Your current focus is on the current-day Member of Parliament (MP) mentioned below.
+
+        Examine the original question below. If you can answer it, do so. If not, perform a web search to find the best results and explain the findings.
+
+        RULES:
+        - ALWAYS provide URL sources if possible, included after the relevant statement on the same text line, formatted as "[SOURCE URL: URL HERE].
+
+        - Keep your explanation brief, no more than 2 paragraphs worth of text.
+
+        - For complex or reasoning questions, explain your reasoning step by step before giving the final answer, for example:
+            User: Why did the MP vote against the bill?
+            AI: To answer, I'll check the MP's voting record, public statements, and any debate contributions. The MP voted against the bill [SOURCE URL:...]. In the debate, she expressed concerns about funding allocations [SOURCE URL:...]. Her official statement cited local constituent feedback as a factor [SOURCE URL:...]. Therefore, the MP's reasons appear to be funding concerns and constituent input.
             
-            return results.content
+        """
+        ),
+        ("human", "Todays date: {date}"),
+        ("human", "MP name: {mp_name}"),
+        ("human", "MP constituency: {mp_constituency}"),
+        ("human", "User self-described expertise: {user_competency}"),
+        ("human", "Original question: {question}"),
         
-    
+    ]
+)
+
+chain_web_search = prompt_template_search | llm_with_tools
+
+
+prompt_template_political_bias = ChatPromptTemplate.from_messages(
+    [SystemMessage(
+        content="""
+        Your name is Civic Sage. You are designed to helpfully answer questions about UK politics, government and parliament. Your current focus is on the current-day Member of Parliament (MP) labelled below.
+
+        Labelled below is an original text you generated.
+
+        Now rephrase your original text as needed, considering that you are an unbiased person whose priority is to present information impartially. 
+        If the question is potentially contentious, explicitly reference multiple viewpoints or major party perspectives, and include source URLs for verification. 
+        You do not discriminate or frame answers on the basis of political belief, gender, race, religion, or any other sensitive attribute.
+        
+        ALWAYS provide URL sources if possible, included after the relevant statement on the same text line, formatted as "[SOURCE URL: URL HERE].              
+
+        The original question is also labelled below.
+        """
+        ),
+        ("human", "Todays date: {date}"),
+        ("human", "MP name: {mp_name}"),
+        ("human", "Original text generated: {original_response}"),
+        ("human", "Original question: {question}"),
+    ]
+)
+
+chain_political_debias = prompt_template_political_bias | llm
+
+
+def get_final_stage(result, answer_mode):
+    # Which final stage the first answer goes through - "PERSONAL" (re-direct), "UNKNOWN" (web search), "DEBIAS" or "ANSWER" (used as-is)
+    if not hasattr(result, "content"):
+        return "ANSWER"
+
+    if result.content.strip() in ["PERSONAL", "UNKNOWN"]:
+        return result.content.strip()
+
+    # In "fused" mode the answer was already generated with the debiasing rules, so is only rewritten if it fails the local check
+    if answer_mode == "fused" and not needs_debias(result.content):
+        return "ANSWER"
+
+    return "DEBIAS"
+
+
+def format_web_search_results(search_results):
+    # Check if the LLM actually performed a web search or just answered it by-itself and classify accordingly 
+    # (some responses are UNKNOWN) but don't require a web search
+    if search_results.additional_kwargs.get("tool_outputs"):
+        return f"WEB SEARCH: Unfortunately I couldn't generate an answer based on my internal data. Instead, here's what I found from searching the internet:\n___\n{search_results.content[0]['text']}"
+    else:
+        return search_results.content[0]["text"]
+
+
+def check_and_search_stream(result, retriever, mp_name, mp_constituency, date, user, answer_mode=ANSWER_MODE, session_history=None):
+    # Yields the final response in chunks - the redirect and debias replies are streamed token by token as the LLM generates them
+    final_stage = get_final_stage(result, answer_mode)
+    # Original question, from the chat history
+    question = get_session_history(session_history).get_last_message()["message"].content
+
+    # If results are too personal, re-direct.
+    if final_stage == "PERSONAL":
+        # Contact details are precomputed at ingestion, so normally no retrieval is needed (falls back to one for MPs without it)
+        contact_context = get_mp_contact_context(mp_name) or format_docs(retriever.invoke("MP contact details"))
+
+        yield "SENSITIVE REPLY: \n___\n"
+        for chunk in chain_redirect_contact.stream({"context": contact_context, "message": question}):
+            yield chunk.content
+
+    # If no relevant results found, conduct a websearch
+    elif final_stage == "UNKNOWN":
+        if not question:
+            yield "Unable to perform web search: No question found."
+            return
+
+        try:
+            search_results = chain_web_search.invoke({"question": question, "mp_name": mp_name, "mp_constituency": mp_constituency, "date": date, "user_competency": user.get_competencies_plaintext()})
+            yield format_web_search_results(search_results)
+
+        except Exception as e:
+            yield f"Error performing web search: {str(e)}"
+
+    # If not PERSONAL/UNKNOWN, question was successful, now run additional political-debiasing prompt
+    elif final_stage == "DEBIAS" and question:
+        for chunk in chain_political_debias.stream({"question": question, "original_response": result.content, "mp_name": mp_name, "date": date}):
+            yield chunk.content
+
     # If result is not an AIMessage, return it as is
-    return result
+    else:
+        yield result.content if hasattr(result, "content") else result
+
+
+async def acheck_and_search_stream(result, retriever, mp_name, mp_constituency, date, user, answer_mode=ANSWER_MODE, session_history=None):
+    # Async version of check_and_search_stream
+    final_stage = get_final_stage(result, answer_mode)
+    question = get_session_history(session_history).get_last_message()["message"].content
+
+    if final_stage == "PERSONAL":
+        contact_context = await asyncio.to_thread(get_mp_contact_context, mp_name) or format_docs(await retriever.ainvoke("MP contact details"))
+
+        yield "SENSITIVE REPLY: \n___\n"
+        async for chunk in chain_redirect_contact.astream({"context": contact_context, "message": question}):
+            yield chunk.content
+
+    elif final_stage == "UNKNOWN":
+        if not question:
+            yield "Unable to perform web search: No question found."
+            return
+
+        try:
+            search_results = await chain_web_search.ainvoke({"question": question, "mp_name": mp_name, "mp_constituency": mp_constituency, "date": date, "user_competency": user.get_competencies_plaintext()})
+            yield format_web_search_results(search_results)
+
+        except Exception as e:
+            yield f"Error performing web search: {str(e)}"
+
+    elif final_stage == "DEBIAS" and question:
+        async for chunk in chain_political_debias.astream({"question": question, "original_response": result.content, "mp_name": mp_name, "date": date}):
+            yield chunk.content
+
+    else:
+        yield result.content if hasattr(result, "content") else result
 
 
-def safely_add_message(input):
+def safely_add_message(input, session_history=None):
 
     # If a dict, it is a question asked by user
     if type(input) == dict:
         try:
         # Add the human message to chat history
-            chat_history.add_message(HumanMessage(content=input["question"]))
+            get_session_history(input.get("session_history", session_history)).add_message(HumanMessage(content=input["question"]))
         except Exception as e:
             print(f"Error adding User message to history: {e}")
         return input
@@ -331,7 +548,7 @@ def safely_add_message(input):
     # If a str, it is a formatted LLM response
     elif type(input) == str:
         try:
-            chat_history.add_message(AIMessage(content=input))
+            get_session_history(session_history).add_message(AIMessage(content=input))
         except Exception as e:
             print(f"Error adding AI message to history: {e}")
         return input
@@ -340,7 +557,11 @@ def safely_add_message(input):
         print(f"Message couldn't be added to history, unexpected input: {input}")
 
 
-def ask_prompt(question, user, mp_name, mp_constituency):
+@lru_cache(maxsize=MP_CHAIN_CACHE_SIZE)
+def get_mp_chain(mp_name, answer_mode=ANSWER_MODE):
+    # Built once per MP namespace and shared across questions and sessions - anything which changes per question
+    # (user, date, and the session's chat history as "session_history") is passed in through the chain's input.
+    # The chain stops at the first answer - the final stage (check_and_search_stream) is run separately so it can be streamed
     vector_store = PineconeVectorStore(index=dense_index, embedding=embeddings, namespace=mp_name)
 
     retriever = vector_store.as_retriever(
@@ -349,25 +570,118 @@ def ask_prompt(question, user, mp_name, mp_constituency):
         text_key="data",
     )
 
-    date_today = str(datetime.today())
-
-    combined_chain = (
+    answer_chain = (
         RunnableLambda(safely_add_message)
+        # Retrieval (embedding + Pinecone query) and history summarisation are independent, so are run in parallel
         | RunnablePassthrough.assign(
-            context=RunnableLambda(lambda x: x["question"]) | retriever | format_docs 
+            context=timed("Context Retrieval", RunnableLambda(lambda x: x["question"]) | retriever | format_docs),
+            history=timed("History Summary", RunnableLambda(summarize_history, afunc=asummarize_history)),
         )
         | RunnablePassthrough.assign(
-            history=RunnableLambda(lambda x: summarize_history(x))
+            result=timed("Answer", (prompt_template_fused if answer_mode == "fused" else prompt_template) | llm)
         )
-        | prompt_template
-        | llm
-        | RunnableLambda(partial(check_and_search, retriever=retriever, mp_name=mp_name, mp_constituency=mp_constituency, date=date_today, user=user))
-        | RunnableLambda(safely_add_message)
     )
 
-    result = combined_chain.invoke({"question": question, "user_competency": user.get_competencies_plaintext(), "date": date_today})
+    return answer_chain, retriever
+
+
+def ask_prompt_stream(question, user, mp_name, mp_constituency, answer_mode=None, use_answer_cache=None, session_history=None):
+    # Yields the response as it's generated, then adds the full response to the chat history once complete
+    # answer_mode / use_answer_cache default to the module settings at call time, so they can be switched for a whole run (e.g. evaluation)
+    answer_mode = answer_mode or ANSWER_MODE
+    use_answer_cache = USE_ANSWER_CACHE if use_answer_cache is None else use_answer_cache
+    session_history = get_session_history(session_history)
+
+    answer_chain, retriever = get_mp_chain(mp_name, answer_mode)
+
+    date_today = str(datetime.today())
+    user_competency = user.get_competencies_plaintext()
+
+    # Answers depend on the chat history, so only a session's first question is looked up in (or stored to) the answer cache.
+    # The cache is shared by every user, so questions containing personal data (which the answer may echo back) are never cached
+    question_embedding = None
+    if use_answer_cache and not session_history.all_messages and not analysis_utils.contains_personal_data(question, mp_name):
+        question_embedding = embeddings.embed_query(question)
+        cached_answer = cache_utils.answer_cache.get(mp_name, question_embedding, user_competency)
+
+        if cached_answer:
+            safely_add_message({"question": question}, session_history)
+            yield cached_answer
+            safely_add_message(cached_answer, session_history)
+            return
+
+    answer = answer_chain.invoke({"question": question, "user": user, "user_competency": user_competency, "date": date_today, "session_history": session_history})
+    print(f"[{mp_name}]: " + ", ".join(f"{branch_name}: {branch_time:.2f}s" for branch_name, branch_time in session_history.timings.items()))
+
+    response_chunks = []
+    for chunk in check_and_search_stream(answer["result"], retriever, mp_name, mp_constituency, date_today, user, answer_mode, session_history):
+        if chunk:
+            response_chunks.append(chunk)
+            yield chunk
+
+    response = "".join(response_chunks)
+
+    # Only plain answers are cached - not redirects or web searches
+    if question_embedding is not None and answer["result"].content.strip() not in ["PERSONAL", "UNKNOWN"]:
+        cache_utils.answer_cache.add(mp_name, question_embedding, user_competency, response)
+
+    safely_add_message(response, session_history)
+
+
+async def aask_prompt_stream(question, user, mp_name, mp_constituency, answer_mode=None, use_answer_cache=None, session_history=None):
+    # Async version of ask_prompt_stream - every LLM, embedding and Pinecone call is awaited (ainvoke / astream), so one worker
+    # can serve many sessions' questions concurrently. Blocking DynamoDB lookups are run in a thread
+    answer_mode = answer_mode or ANSWER_MODE
+    use_answer_cache = USE_ANSWER_CACHE if use_answer_cache is None else use_answer_cache
+    session_history = get_session_history(session_history)
+
+    answer_chain, retriever = get_mp_chain(mp_name, answer_mode)
+
+    date_today = str(datetime.today())
+    user_competency = user.get_competencies_plaintext()
+
+    question_embedding = None
+    if use_answer_cache and not session_history.all_messages and not await asyncio.to_thread(analysis_utils.contains_personal_data, question, mp_name):
+        question_embedding = await embeddings.aembed_query(question)
+        cached_answer = await asyncio.to_thread(cache_utils.answer_cache.get, mp_name, question_embedding, user_competency)
+
+        if cached_answer:
+            safely_add_message({"question": question}, session_history)
+            yield cached_answer
+            safely_add_message(cached_answer, session_history)
+            return
+
+    answer = await answer_chain.ainvoke({"question": question, "user": user, "user_competency": user_competency, "date": date_today, "session_history": session_history})
+    print(f"[{mp_name}]: " + ", ".join(f"{branch_name}: {branch_time:.2f}s" for branch_name, branch_time in session_history.timings.items()))
+
+    response_chunks = []
+    async for chunk in acheck_and_search_stream(answer["result"], retriever, mp_name, mp_constituency, date_today, user, answer_mode, session_history):
+        if chunk:
+            response_chunks.append(chunk)
+            yield chunk
+
+    response = "".join(response_chunks)
+
+    if question_embedding is not None and answer["result"].content.strip() not in ["PERSONAL", "UNKNOWN"]:
+        cache_utils.answer_cache.add(mp_name, question_embedding, user_competency, response)
+
+    safely_add_message(response, session_history)
+
+
+async def aask_prompt(question, user, mp_name, mp_constituency, answer_mode=None, use_answer_cache=None, session_history=None):
+    session_history = get_session_history(session_history)
+    result = "".join([chunk async for chunk in aask_prompt_stream(question, user, mp_name, mp_constituency, answer_mode, use_answer_cache, session_history)])
+
+    message_index = session_history.get_last_message()["message_index"]
+
+    return result, message_index
+
+
+def ask_prompt(question, user, mp_name, mp_constituency, answer_mode=None, use_answer_cache=None, session_history=None):
+    session_history = get_session_history(session_history)
+    result = "".join(ask_prompt_stream(question, user, mp_name, mp_constituency, answer_mode, use_answer_cache, session_history))
 
     # This is not optimal but fastest way at current moment
-    message_index = chat_history.get_last_message()["message_index"]
+    message_index = session_history.get_last_message()["message_index"]
 
-    return result, message_index
\ No newline at end of file
+    return result, message_index
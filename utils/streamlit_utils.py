@@ -6,6 +6,7 @@ from io import BytesIO, StringIO
 from datetime import datetime, timedelta
 import uuid
 import time
+import itertools
 from langchain_core.messages import HumanMessage, AIMessage
 
 import streamlit as st
@@ -22,7 +23,6 @@ import utils.location_utils as location_utils
 THEMES_MAIN = "#3087ff"
 THEMES_SELECT_BACKGROUND = "#e3e7ee"
 THEMES_SELECT_ELEMENT = "#1d2345"
-SPEECH_DELAY = 0.1
 
 # Only covering main parties currently, as the ones in our analysis are Conservative, Labour.
 PARTY_THEMES = {
@@ -242,7 +242,8 @@ def usage_agreement_and_init_setup(mp_name):
         # Set up user and chat history.
         st.session_state.usage_agreement = True
 
-        chat_history = rag_llm_utils.init(ch=rag_llm_utils.ChatHistory(size=20))
+        # Each session keeps its own chat history, which is passed into every rag_llm_utils call explicitly
+        chat_history = rag_llm_utils.ChatHistory(size=20)
 
         st.session_state.user = rag_llm_utils.User(competencies={
             "UK Politics": user_knowledge_politics,
@@ -283,7 +284,7 @@ def report_message(message, message_index) -> None:
         st.session_state.report_submitted = True
 
         previous_messages = st.session_state.chat_history.get_reported_message_context(message_index)
-        previous_messages_anonymised = [analysis_utils.anonymize_text(message, st.session_state.current_mp) for message in previous_messages]
+        previous_messages_anonymised = analysis_utils.anonymize_texts(previous_messages, st.session_state.current_mp)
 
         boto_utils.dynamodb_upload_record(
             message_reports_table,
@@ -357,7 +358,8 @@ def get_mp_summary_from_db(mp_name):
 
 
 def handle_mp_cleanup():
-    with st.spinner("Saving conversation analysis..."):
+    with st.spinner("Saving conversation..."):
+        # Only anonymises & queues the conversation - it's analysed afterwards by the analysis worker
         analysis_utils.analyse_chat(st.session_state)
         st.session_state["current_page_function"] = "Find an MP"
         del st.session_state.current_mp
@@ -366,11 +368,12 @@ def handle_mp_cleanup():
         del st.session_state.mp_keywords
         del st.session_state.usage_agreement
         del st.session_state.location
+        del st.session_state.location_codes
 
     
 def setup_mp_summary_details(mp_name, mp_summary_data):
     # NOTE: Temporary notice for testing
-    st.info("**TESTERS:** To save your conversation for analysis, you **must** use the **:material/arrow_back: button** to exit the page due to current platform limitations. Occasionally, this may take some time to process.", icon=":material/construction:")
+    st.info("**TESTERS:** To save your conversation for analysis, you **must** use the **:material/arrow_back: button** to exit the page due to current platform limitations.", icon=":material/construction:")
 
     # Structure
     col_portrait, col_content = st.columns([1, 3], gap="small")
@@ -496,21 +499,38 @@ def format_datetime(input_datetime):
         return input_datetime.strftime("%d/%m/%y %H:%M")
 
 
-def speak_ai_response(message):
-    for word in message.split(" "):
-        yield word + " "
-        time.sleep(SPEECH_DELAY)
-
-
-def send_chat_message(chat_message_dict, speak=False):
+def send_chat_message(chat_message_dict, response_stream=None):
     # Set up chat entry
     with st.chat_message(chat_message_dict["role"]):
 
         # IF = AI - Write response with special embeds/set-up
         if chat_message_dict["role"] == "ai":
 
+            # Header title
+            st.markdown(f"""
+                <div style="display: flex; margin-top: 10px;">
+                    <p style='font-size: 18px; line-height: 0px; color: {THEMES_MAIN};'><b>Civic Sage</b></p>
+                    <p style='font-size: 14px; line-height: 0px;'>&nbsp;&nbsp;&nbsp;• &nbsp;&nbsp; {format_datetime(chat_message_dict["time"])}</p>
+                </div>
+            """, unsafe_allow_html=True)
+
+            # Warnings are only known once the full response is, so are filled in above the message afterwards
+            warnings_container = st.container()
+            message_placeholder = st.empty()
+
+            # Messages are re-loaded in every dialog turn, so throw all of the history in. If it's the CURRENT LLM response, write it live as it's generated.
+            if response_stream:
+                with st.spinner(":material/network_intelligence: Civic Sage is thinking...", show_time=True):
+                    first_chunk = next(response_stream, "")
+
+                llm_message = message_placeholder.write_stream(itertools.chain([first_chunk], response_stream))
+
+                # The response is only added to the chat history once fully streamed
+                chat_message_dict["message_index"] = st.session_state.chat_history.get_last_message()["message_index"]
+            else:
+                llm_message = chat_message_dict["message"].content
+
             # First identify components of the response.
-            llm_message = chat_message_dict["message"].content
             llm_sources = None
             llm_web_search = None
             llm_sensitive_reply = None
@@ -526,25 +546,15 @@ def send_chat_message(chat_message_dict, speak=False):
                 llm_message = llm_message.split("SENSITIVE REPLY:")[1]
                 llm_sensitive_reply = True
 
-            # Header title
-            st.markdown(f"""
-                <div style="display: flex; margin-top: 10px;">
-                    <p style='font-size: 18px; line-height: 0px; color: {THEMES_MAIN};'><b>Civic Sage</b></p>
-                    <p style='font-size: 14px; line-height: 0px;'>&nbsp;&nbsp;&nbsp;• &nbsp;&nbsp; {format_datetime(chat_message_dict["time"])}</p>
-                </div>
-            """, unsafe_allow_html=True)
-
-            if llm_web_search:
-                st.warning("This response uses content from a websearch. Information should be manually verified.", icon=":material/language:")
+            with warnings_container:
+                if llm_web_search:
+                    st.warning("This response uses content from a websearch. Information should be manually verified.", icon=":material/language:")
 
-            if llm_sensitive_reply:
-                st.error("If you are in immediate danger or facing an emergency, please call 999 or [contact the relevant emergency services immediately](https://join.humber.nhs.uk/international-welcome-hub/emergency-contacts/).\n\nCivic Sage cannot provide assistance in urgent or life-threatening situations.", icon=":material/emergency_home:")
+                if llm_sensitive_reply:
+                    st.error("If you are in immediate danger or facing an emergency, please call 999 or [contact the relevant emergency services immediately](https://join.humber.nhs.uk/international-welcome-hub/emergency-contacts/).\n\nCivic Sage cannot provide assistance in urgent or life-threatening situations.", icon=":material/emergency_home:")
 
-            # Messages are re-loaded in every dialog turn, so throw all of the history in. If it's the CURRENT LLM response, 'speak/write' it instead for effect.
-            if speak:
-                st.write_stream(speak_ai_response(llm_message))
-            else:
-                st.write(llm_message)
+            # Replaces the raw streamed text (if any) with the formatted message, sources split out below
+            message_placeholder.write(llm_message)
 
             # Sources & Report Response footers
             col_1, col_2 = st.columns([5, 1])
@@ -580,11 +590,10 @@ def process_prompt_and_response(prompt, llm_user, current_mp, current_mp_constit
     # 2. Process prompt through LLM pipeline. It also:
         # Stores/maintains chat history obj.
     st.write("")
-    with st.spinner(":material/network_intelligence: Civic Sage is thinking...", show_time=True):
-        llm_response, llm_response_index = rag_llm_utils.ask_prompt(prompt, llm_user, current_mp, current_mp_constituency)
+    response_stream = rag_llm_utils.ask_prompt_stream(prompt, llm_user, current_mp, current_mp_constituency, use_answer_cache=True, session_history=st.session_state.chat_history)
 
-    # 3. Return LLM response
-    send_chat_message({"role": "ai", "message": AIMessage(llm_response), "time": datetime.now(), "message_index": llm_response_index}, speak=True)
+    # 3. Return LLM response, written as it's generated
+    send_chat_message({"role": "ai", "time": datetime.now()}, response_stream=response_stream)
 
 
 def process_chat_history():